@@ -0,0 +1,368 @@
+import asyncio
+import logging
+from datetime import datetime
+
+import httpx
+
+import global_controller as settings
+from dispatch_queue import JobQueue, load_jobs
+from global_controller import (
+    average_cluster_cpu,
+    check_started_nodes,
+    get_placement_stats,
+    log_client_stats,
+    node_is_empty,
+    plan_batches,
+    read_file_to_list,
+    record_assignment,
+    record_cluster_cpu,
+    record_node_samples,
+    record_scale_down,
+    record_scale_up,
+    scale_down_node,
+    scale_up_node,
+)
+from http_client import ClusterStateStream, LatencyStats, read_event_line
+from ring_buffer import RingBuffer
+
+
+class AsyncClusterStateStream(ClusterStateStream):
+    """ClusterStateStream read through an httpx.AsyncClient by a task of the event loop."""
+
+    def __init__(self, client, url, read_timeout=60, retry_delay=1):
+        super().__init__(client, url, retry_delay=retry_delay)
+        self.read_timeout = read_timeout
+
+    def start(self):
+        return asyncio.create_task(self.run(), name="cluster_stream")
+
+    async def run(self):
+        timeout = httpx.Timeout(self.read_timeout, connect=settings.http_connect_timeout)
+        while True:
+            try:
+                async with self.client.stream("GET", self.url, params=self.params(), timeout=timeout) as response:
+                    response.raise_for_status()
+                    data = []
+                    async for line in response.aiter_lines():
+                        event = read_event_line(line, data)
+                        if event is not None:
+                            self.receive(event)
+                logging.warning(f"stream {self.url} ended, reconnecting")
+            except Exception as e:
+                logging.error(f"stream {self.url} failed: {e}, reconnecting in {self.retry_delay}s")
+            self.disconnected()
+            await asyncio.sleep(self.retry_delay)
+
+
+class AsyncGlobalController:
+    """The global controller with its three loops as tasks of one asyncio event loop.
+
+    Sampling, scaling decisions and job dispatch share the state held by this object instead
+    of module globals. Their HTTP calls go through one httpx.AsyncClient and overlap, and
+    the node lists are only changed under nodes_lock, so the sampler can't remove a node
+    while a scaling decision is using it. Settings and APIs are read from global_controller,
+    and the decisions on the answers are made by its functions, only the I/O is done here.
+    """
+
+    def __init__(self, job_list, client=None):
+        """job_list holds the lines of a job file"""
+        self.worker_nodes = list(settings.worker_nodes)
+        self.started_nodes = [settings.master_node]
+        self.cluster_cpu = RingBuffer(settings.cluster_cpu_history)  # recent cluster CPU usage
+        self.last_started_time = datetime.now()
+        self.job_queue = JobQueue(settings.job_max_retries, settings.job_retry_delay)  # jobs not dispatched yet
+        load_jobs(self.job_queue, job_list)
+        self.node_stats = {}  # node -> (pod num, maxpod) from the last sample that node answered in time
+        self.stale_nodes = set()  # nodes whose pod num and maxpod in node_stats are not from the current sample
+        self.deleted_seq = 0  # latest reaped pod sequence number seen in /cluster-state
+        self.assign_stats = {"sent": 0, "failed": 0}  # job POSTs to the local controllers, and how many were refused
+        self.latency = LatencyStats()
+        self.nodes_lock = asyncio.Lock()
+        self.tasks = []
+        if client is None:
+            # connection errors are retried by the transport, the request was never sent
+            client = httpx.AsyncClient(
+                timeout=httpx.Timeout(settings.http_read_timeout, connect=settings.http_connect_timeout),
+                transport=httpx.AsyncHTTPTransport(retries=settings.http_retries),
+            )
+        self.client = client
+        self.cluster_stream = AsyncClusterStateStream(client, settings.stream_api)
+
+    async def call(self, method, url, timeout=None, **kwargs):
+        """send a request and return (JSON answer, error)"""
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        try:
+            if timeout is not None:
+                kwargs["timeout"] = timeout
+            response = await self.client.request(method, url, **kwargs)
+            self.latency.record(url, loop.time() - start, False)
+            if response.status_code == 200:
+                return response.json(), None
+            else:
+                return None, f"Error: {response.status_code}"
+        except Exception as e:
+            self.latency.record(url, loop.time() - start, True)
+            return None, e
+
+    async def call_ok(self, method, url, **kwargs):
+        """send a request answered with {"success", "msg"}, return (success, msg)"""
+        res, err = await self.call(method, url, **kwargs)
+        if err is not None:
+            return False, err
+        return res["success"], res["msg"]
+
+    async def get_node_pod_num(self, node, timeout=None):
+        res, err = await self.call("GET", settings.node_pod_api[node], timeout=timeout)
+        if err is not None:
+            return None, err
+        if not res["success"]:
+            return None, f"Error: {res['msg']}"
+        return res["pod-num"], None
+
+    async def get_max_pod(self, node, timeout=None):
+        res, err = await self.call("GET", settings.node_url[node] + "maxpod", timeout=timeout)
+        if err is not None:
+            return None, err
+        if not res["success"]:
+            return None, f"Error: {res['msg']}"
+        return res["maxpod"], None
+
+    async def get_cluster_state(self):
+        """get the node list, CPU usage and pod num of every node in one snapshot"""
+        if settings.use_stream:
+            state = self.cluster_stream.snapshot()
+            if state is not None:
+                return state, None
+        if settings.use_cluster_state:
+            # only the pods reaped since the last snapshot are sent back
+            res, err = await self.call("GET", settings.cluster_state_api, params={"since": self.deleted_seq})
+            if err is not None:
+                return None, err
+            if not res["success"]:
+                return None, f"Error: {res['msg']}"
+            self.deleted_seq = max(self.deleted_seq, res["deleted_seq"])
+            return res, None
+        (nodes, err), (cpu, cpu_err) = await asyncio.gather(
+            self.call("GET", settings.get_nodes_api), self.call("GET", settings.cpu_api)
+        )
+        if err is not None or cpu_err is not None:
+            return None, err or cpu_err
+        if not nodes["success"]:
+            return None, f"Error: {nodes['msg']}"
+        return {"nodes": nodes["nodes"], "cpu": cpu, "pod_num": None}, None
+
+    async def remove_worker(self, node_name):
+        """drop a node that stopped running from the worker and started nodes"""
+        async with self.nodes_lock:
+            if node_name in self.worker_nodes:
+                self.worker_nodes.remove(node_name)
+            if node_name in self.started_nodes:
+                self.started_nodes.remove(node_name)
+
+    async def sample_nodes(self, nodes, pod_nums=None):
+        """query the pod num and maxpod of the nodes concurrently
+
+        Returns {node: (pod num, maxpod)}. A node that fails or doesn't answer within
+        sample_deadline keeps the values of its last good sample and is marked stale.
+        If pod_nums ({node: pod num}) is given, only the maxpod of each node is queried.
+        """
+        pod_num_tasks = {}
+        if pod_nums is None:
+            pod_num_tasks = {
+                node: asyncio.create_task(self.get_node_pod_num(node, settings.node_request_timeout))
+                for node in nodes
+            }
+        maxpod_tasks = {
+            node: asyncio.create_task(self.get_max_pod(node, settings.node_request_timeout))
+            for node in nodes
+        }
+        tasks = list(pod_num_tasks.values()) + list(maxpod_tasks.values())
+        pending = []
+        if tasks:
+            _, pending = await asyncio.wait(tasks, timeout=settings.sample_deadline)
+        # read before cancelling, a cancelled task is done
+        stats = record_node_samples(
+            nodes, pod_num_tasks, maxpod_tasks, pod_nums, self.node_stats, self.stale_nodes
+        )
+        for task in pending:
+            task.cancel()
+        return stats
+
+    async def sample_cpu(self):
+        """sample the cluster CPU"""
+        cur_time = 0
+        loop = asyncio.get_running_loop()
+        while True:
+            next_sample = loop.time() + settings.sample_time
+            state, err = await self.get_cluster_state()
+            if err is not None:
+                logging.critical(f"error getting the cluster state, msg: {err}")
+            else:
+                await self.record_sample(cur_time, state)
+            await asyncio.sleep(max(0, next_sample - loop.time()))
+            cur_time += settings.sample_time
+
+    async def record_sample(self, cur_time, state):
+        running_nodes, nodes_cpu, pod_nums = state["nodes"], dict(state["cpu"]), state["pod_num"]
+        logging.debug(f"running nodes: {running_nodes}")
+        logging.debug(f"nodes_cpu: {nodes_cpu}")
+        sampled_nodes, stopped_nodes = check_started_nodes(list(self.started_nodes), running_nodes, nodes_cpu)
+        for node in stopped_nodes:
+            await self.remove_worker(node)
+        # get pod num and maxpod of all nodes at once
+        sampled_stats = await self.sample_nodes(sampled_nodes, pod_nums)
+        record_cluster_cpu(cur_time, sampled_nodes, nodes_cpu, sampled_stats, self.cluster_cpu)
+        log_client_stats(cur_time, self.latency, self.assign_stats)
+
+    async def controller_step(self, now=None):
+        """make one scaling up or scaling down decision"""
+        if now is None:
+            now = datetime.now()
+        ave_cluster_cpu = average_cluster_cpu(self.cluster_cpu)
+        if ave_cluster_cpu is None:
+            return
+        async with self.nodes_lock:
+            new_node = scale_up_node(ave_cluster_cpu, self.started_nodes, self.worker_nodes)
+            if new_node is not None:
+                await self.scale_up(new_node, now)
+            target_node = scale_down_node(now, self.last_started_time, self.started_nodes)
+            if target_node is not None:
+                await self.scale_down(target_node)
+
+    async def scale_up(self, new_node, now):
+        ok, err = await self.call_ok("POST", settings.start_node_api, json={"node": new_node})
+        if not ok:
+            logging.error(f"error trying to start node {new_node}, msg: {err}")
+            return
+        ok, msg = await self.call_ok("GET", settings.node_url[new_node] + "start")
+        if not ok:
+            logging.error(f"error trying to start the controller for node {new_node}, msg: {msg}")
+            return
+        self.started_nodes.append(new_node)
+        record_scale_up(new_node, self.cluster_cpu)
+        self.last_started_time = now
+
+    async def scale_down(self, target_node):
+        pod_num, err = await self.get_node_pod_num(target_node)
+        if not node_is_empty(target_node, pod_num, err):
+            return
+        ok, e = await self.call_ok("POST", settings.delete_node_api, json={"node": target_node})
+        if not ok:
+            logging.error(f"error when deleting node {target_node}, error: {e}")
+            return
+        ok, msg = await self.call_ok("GET", settings.node_url[target_node] + "stop")
+        self.started_nodes.remove(target_node)
+        record_scale_down(target_node)
+        if not ok:
+            logging.error(
+                f"error when stopping controller of the deleted node {target_node}, error: {msg}"
+            )
+
+    async def controller(self):
+        """make scaling up of scaling down decision"""
+        while True:
+            await self.controller_step()
+            await asyncio.sleep(settings.loop_sleep_time)
+
+    async def assign_jobs(self, jobs, node_name):
+        """try to assign a batch of jobs to a node with one request, return [(ok, msg)] per job"""
+        payload = {"jobs": [job.to_dict() for job in jobs]}
+        res, err = await self.call("POST", settings.node_jobs_api[node_name], json=payload)
+        if err is not None:
+            return [(False, err)] * len(jobs)
+        if len(res["results"]) != len(jobs):
+            return [(False, res["msg"])] * len(jobs)
+        return [(result["success"], result["msg"]) for result in res["results"]]
+
+    async def dispatch_jobs(self):
+        """send as many queued jobs as the started nodes have room for, concurrently
+
+        Each job is placed by placement_policy on the cached pod num and maxpod of the nodes, and
+        the jobs of a node are sent as one batch. Returns the number of jobs dispatched. A job a
+        node refused goes back to the queue.
+        """
+        batches = plan_batches(
+            self.job_queue, get_placement_stats(self.started_nodes, self.node_stats, self.stale_nodes)
+        )
+        results = await asyncio.gather(
+            *(self.assign_jobs([entry.job for entry in entries], node) for node, entries in batches.items())
+        )
+        dispatched = 0
+        for (node, entries), node_results in zip(batches.items(), results):
+            for entry, (ok, err) in zip(entries, node_results):
+                if record_assignment(
+                    entry, node, ok, err, self.node_stats, self.job_queue, self.assign_stats
+                ):
+                    dispatched += 1
+        return dispatched
+
+    async def job_scheduling(self):
+        while len(self.job_queue) != 0:
+            await self.dispatch_jobs()
+            await asyncio.sleep(settings.job_assign_time)
+        logging.info("all jobs assigned")
+
+    async def run(self):
+        """run sampling, scaling and job dispatch until cancelled, or until one of them fails"""
+        self.tasks = []
+        if settings.use_stream:
+            logging.info(f"subscribing to the metrics stream: {settings.stream_api}")
+            self.tasks.append(self.cluster_stream.start())
+        self.tasks += [
+            asyncio.create_task(self.sample_cpu(), name="sample_cpu"),
+            asyncio.create_task(self.controller(), name="controller"),
+            asyncio.create_task(self.job_scheduling(), name="job_scheduling"),
+        ]
+        try:
+            await asyncio.gather(*self.tasks)
+        finally:
+            self.stop()
+            await asyncio.gather(*self.tasks, return_exceptions=True)
+            await self.client.aclose()
+
+    def stop(self):
+        """cancel the running tasks"""
+        for task in self.tasks:
+            task.cancel()
+
+
+async def main(job_list):
+    global_controller = AsyncGlobalController(job_list)
+
+    # manually delete the worker nodes
+    for node in global_controller.worker_nodes:
+        ok, msg = await global_controller.call_ok("POST", settings.delete_node_api, json={"node": node})
+        if not ok:
+            logging.error(f"error when deleting the node {node}, error: {msg}")
+        else:
+            logging.info(f"worker node deleted: {node}")
+    ok, msg = await global_controller.call_ok("GET", settings.node_url[settings.master_node] + "start")
+    if not ok:
+        logging.error(f"error when starting the master node controller, error: {msg}")
+    else:
+        logging.info("master node local controller started")
+
+    logging.info("start sampling, controller and job")
+    await global_controller.run()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.DEBUG,
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    )
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    logging.getLogger("httpcore").setLevel(logging.WARNING)
+
+    job_list, error = read_file_to_list(settings.job_file_name)
+    logging.info(f"getting job list from {settings.job_file_name}")
+    if error != None:
+        logging.critical(f"error getting the job list: {error}")
+        logging.critical("shutting down")
+        exit(0)
+
+    try:
+        asyncio.run(main(job_list))
+    except KeyboardInterrupt:
+        logging.info("shutting down")
@@ -0,0 +1,137 @@
+import heapq
+import logging
+import threading
+import time
+
+from jobs import parse_job
+
+
+class QueuedJob:
+    """A job description waiting in a JobQueue, with its priority and failed attempts."""
+
+    __slots__ = ("job", "priority", "seq", "attempts")
+
+    def __init__(self, job, priority, seq):
+        self.job = job
+        self.priority = priority
+        self.seq = seq  # push order, ties between equal priorities
+        self.attempts = 0
+
+    def __repr__(self):
+        return f"QueuedJob({self.job!r}, priority={self.priority}, attempts={self.attempts})"
+
+
+class JobQueue:
+    """Priority queue of the jobs waiting to be dispatched.
+
+    Jobs with a higher priority are popped first, jobs of equal priority in the order they
+    were pushed; push and pop are O(log n). A job put back with retry() keeps its place but
+    is held back for retry_delay seconds, so a job no node accepts doesn't stop the ones
+    behind it, and it is dropped once it failed max_retries times (never if None).
+    """
+
+    def __init__(self, max_retries=None, retry_delay=0):
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.ready = []  # heap of (-priority, seq, job)
+        self.delayed = []  # heap of (time the job is ready again, seq, job)
+        self.seq = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        with self.lock:
+            return len(self.ready) + len(self.delayed)
+
+    def push(self, job, priority=0):
+        with self.lock:
+            entry = QueuedJob(job, priority, self.seq)
+            self.seq += 1
+            heapq.heappush(self.ready, (-priority, entry.seq, entry))
+            return entry
+
+    def pop_many(self, n, now=None):
+        """Remove and return up to n ready jobs, highest priority first."""
+        if now is None:
+            now = time.monotonic()
+        with self.lock:
+            while self.delayed and self.delayed[0][0] <= now:
+                _, _, entry = heapq.heappop(self.delayed)
+                heapq.heappush(self.ready, (-entry.priority, entry.seq, entry))
+            jobs = []
+            while self.ready and len(jobs) < n:
+                jobs.append(heapq.heappop(self.ready)[2])
+            return jobs
+
+    def retry(self, entry, now=None):
+        """Put back a job that couldn't be dispatched, return False if it was dropped instead."""
+        if now is None:
+            now = time.monotonic()
+        entry.attempts += 1
+        if self.max_retries is not None and entry.attempts > self.max_retries:
+            return False
+        with self.lock:
+            heapq.heappush(self.delayed, (now + self.retry_delay, entry.seq, entry))
+        return True
+
+
+def parse_job_line(line):
+    """Split a job file line into (priority, job).
+
+    A line may start with an integer priority, e.g. "5 stress-ng --cpu 2 --timeout 60s";
+    lines without one have priority 0.
+    """
+    first, _, rest = line.partition(" ")
+    try:
+        return int(first), rest.strip()
+    except ValueError:
+        return 0, line
+
+
+# placement policies, score(pod num, maxpod) of a node with room, the lowest score gets the job
+# and ties go to the node first in preference order
+placement_policies = {
+    "first_fit": lambda pod_num, maxpod: 0,  # first node with room, e.g. the master node first
+    "least_loaded": lambda pod_num, maxpod: pod_num / maxpod,  # lowest share of its maxpod used
+    "bin_packing": lambda pod_num, maxpod: maxpod - pod_num,  # least room left, the last nodes drain
+    "spread": lambda pod_num, maxpod: pod_num,  # fewest pods
+}
+
+
+def plan_dispatch(queue, node_stats, policy="first_fit", now=None):
+    """Pop as many jobs as the nodes have room for and place each one on a node.
+
+    node_stats is {node: (pod num, maxpod)}, in node preference order. policy is the name of
+    one of placement_policies or a score(pod num, maxpod) function. Returns [(job, node)].
+    """
+    score = placement_policies[policy] if isinstance(policy, str) else policy
+    load = {node: pod_num for node, (pod_num, maxpod) in node_stats.items() if maxpod}
+    room = sum(max(0, node_stats[node][1] - pod_num) for node, pod_num in load.items())
+    plan = []
+    for entry in queue.pop_many(room, now):
+        node = min(
+            (node for node, pod_num in load.items() if pod_num < node_stats[node][1]),
+            key=lambda node: score(load[node], node_stats[node][1]),
+        )
+        load[node] += 1
+        plan.append((entry, node))
+    return plan
+
+
+def load_jobs(queue, lines):
+    """Parse the lines of a job file into Jobs and push them, skipping blank and comment lines.
+
+    A line that isn't a valid job is logged and skipped. Returns the number of jobs pushed.
+    """
+    count = 0
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        priority, description = parse_job_line(line)
+        job, err = parse_job(description)
+        if err is not None:
+            logging.error(f"skipping job: {err}")
+            continue
+        queue.push(job, priority)
+        count += 1
+    return count
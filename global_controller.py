@@ -1,15 +1,19 @@
 import time
 import threading
-import requests
 import logging
 from datetime import datetime
-import uuid
+from concurrent.futures import ThreadPoolExecutor, wait
+from http_client import ClusterStateStream, HttpClient
+from dispatch_queue import JobQueue, load_jobs, plan_dispatch
+from ring_buffer import RingBuffer
 # APIs
 get_nodes_api = "http://128.110.217.103:5001/nodes"
 start_node_api = "http://128.110.217.103:5001/start-node"
 delete_node_api = "http://128.110.217.103:5001/delete-node"
 cpu_api = "http://128.110.217.103:5001/cpu"
 pod_num_api = "http://128.110.217.103:5001/pod-num"
+cluster_state_api = "http://128.110.217.103:5001/cluster-state"
+stream_api = "http://128.110.217.103:5001/stream"
 
 # settings
 sample_time = 1  # every X seconds, save the CPU usage of each node
@@ -22,21 +26,12 @@ worker_nodes = [
     "node2",
 ]  # list of the two workers, in the order of jobs assignemnt priority, e.g., job will be assigned to master node, if unable, to the worker1, then worker2
 
+local_controller_url = "http://128.110.217.103:5004/"  # one local controller process runs the closed loop of every node
 node_url = {
-    master_node: "http://128.110.217.103:5004/",
-    worker_nodes[0]: "http://128.110.217.106:5004/",
-    worker_nodes[1]: "http://128.110.217.82:5004/",
-}
-node_job_api = {
-    master_node: node_url[master_node] + "job",
-    worker_nodes[0]: node_url[worker_nodes[0]] + "job",
-    worker_nodes[1]: node_url[worker_nodes[1]] + "job",
-}
-node_pod_api = {
-    master_node: node_url[master_node] + "pod-num",
-    worker_nodes[0]: node_url[worker_nodes[0]] + "pod-num",
-    worker_nodes[1]: node_url[worker_nodes[1]] + "pod-num",
+    node: f"{local_controller_url}nodes/{node}/" for node in [master_node] + worker_nodes
 }
+node_jobs_api = {node: url + "jobs" for node, url in node_url.items()}  # batch of jobs
+node_pod_api = {node: url + "pod-num" for node, url in node_url.items()}
 
 cpu_bar = 0.8
 number_cpu_data_used = (
@@ -45,12 +40,24 @@ number_cpu_data_used = (
 node_start_delay = (
     30  # no scaling down decision in X seconds after a scaling up decision
 )
-job_assign_time = 15  # every X seconds, schedule a job
+job_assign_time = 1  # every X seconds, dispatch as many jobs as the started nodes have room for
+job_max_retries = 20  # a job refused this many times is dropped
+job_retry_delay = 15  # a refused job is retried after X seconds, the jobs behind it are dispatched meanwhile
+placement_policy = "first_fit"  # first_fit, least_loaded, bin_packing or spread, see dispatch_queue.placement_policies
+node_request_timeout = 0.5  # timeout in seconds of each per-node request made while sampling
+sample_deadline = 0.8  # nodes that don't answer within X seconds of a sampling tick are marked stale
+http_connect_timeout = 1  # seconds to wait for a connection to the middleware or a local controller
+http_read_timeout = 5  # seconds to wait for a response once connected
+http_retries = 2  # number of retries of a failed idempotent call
+latency_log_time = 60  # every X seconds, log the latency of each endpoint
+use_cluster_state = True  # read nodes, CPU and pod nums from one /cluster-state call per sample
+use_stream = False  # read nodes, CPU and pod nums from a /stream subscription instead of polling
 job_file_name = "job_list.txt"
 res_file = "global_controller.txt"
 node_num_file = "node.txt"  # store total number of nodes
 pod_num_file = "pod.txt"  # store total number of pods in the cluster
 cpu_file = "cpu.txt"
+cluster_cpu_history = 60  # number of cluster CPU samples kept in memory, the full history is in cpu_file
 
 
 # global variables
@@ -59,18 +66,31 @@ cpu_file = "cpu.txt"
 #     worker_nodes[0]: [],
 #     worker_nodes[1]: [],
 # }
-cluster_cpu = []  # recent cluster CPU usage
+cluster_cpu = RingBuffer(cluster_cpu_history)  # recent cluster CPU usage
 started_nodes = [
     master_node,
     # "node1.group-3-project.ufl-eel6871-fa23-pg0.utah.cloudlab.us",
 ]  # the nodes that have been started by the controller.
 last_started_time = datetime.now()
-job_list = []
+job_queue = JobQueue(job_max_retries, job_retry_delay)  # jobs not dispatched yet
+node_stats = {}  # node -> (pod num, maxpod) from the last sample that node answered in time
+stale_nodes = set()  # nodes whose pod num and maxpod in node_stats are not from the current sample
+deleted_seq = 0  # latest reaped pod sequence number seen in /cluster-state, its pod names are not needed here
+node_query_executor = ThreadPoolExecutor(max_workers=8)
+node_probes = {}  # (query function, node) -> Future of its last sampling request, reused while it runs
+job_dispatch_executor = ThreadPoolExecutor(max_workers=8)
+assign_stats = {"sent": 0, "failed": 0}  # job POSTs to the local controllers, and how many were refused
+http = HttpClient(
+    connect_timeout=http_connect_timeout,
+    read_timeout=http_read_timeout,
+    retries=http_retries,
+)
+cluster_stream = ClusterStateStream(http, stream_api)
 
 
-def get_node_pod_num(node):
+def get_node_pod_num(node, timeout=None, retry=True):
     try:
-        response = requests.get(node_pod_api[node])
+        response = http.get(node_pod_api[node], timeout=timeout, retry=retry)
         if response.status_code == 200:
             res = response.json()
             if res["success"]:
@@ -83,9 +103,9 @@ def get_node_pod_num(node):
         return None, e
 
 
-def get_max_pod(node):
+def get_max_pod(node, timeout=None, retry=True):
     try:
-        response = requests.get(node_url[node] + "maxpod")
+        response = http.get(node_url[node] + "maxpod", timeout=timeout, retry=retry)
         if response.status_code == 200:
             res = response.json()
             if res["success"]:
@@ -115,7 +135,7 @@ def read_file_to_list(file_path):
 def get_nodes():
     """get the current running nodes"""
     try:
-        response = requests.get(get_nodes_api)
+        response = http.get(get_nodes_api)
         if response.status_code == 200:
             res = response.json()
             if res["success"]:
@@ -131,7 +151,7 @@ def get_nodes():
 def get_cpu():
     """get the current CPU usage"""
     try:
-        response = requests.get(cpu_api)
+        response = http.get(cpu_api)
         if response.status_code == 200:
             cpu_data = response.json()
             return cpu_data, None
@@ -141,10 +161,29 @@ def get_cpu():
         return None, e
 
 
+def get_cluster_state():
+    """get the node list, CPU usage and pod num of every node in one snapshot"""
+    global deleted_seq
+    try:
+        # only the pods reaped since the last snapshot are sent back
+        response = http.get(cluster_state_api, params={"since": deleted_seq})
+        if response.status_code == 200:
+            res = response.json()
+            if res["success"]:
+                deleted_seq = max(deleted_seq, res["deleted_seq"])
+                return res, None
+            else:
+                return None, f"Error: {res['msg']}"
+        else:
+            return None, f"Error: {response.status_code}"
+    except Exception as e:
+        return None, e
+
+
 def delete_node(node_name):
     try:
         payload = {"node": node_name}
-        response = requests.post(delete_node_api, json=payload)
+        response = http.post(delete_node_api, json=payload)
         if response.status_code == 200:
             res = response.json()
             return res["success"], res["msg"]
@@ -156,7 +195,7 @@ def delete_node(node_name):
 
 def start_controller(node_name):
     try:
-        response = requests.get(node_url[node_name] + "start")
+        response = http.get(node_url[node_name] + "start")
         if response.status_code == 200:
             res = response.json()
             return res["success"], res["msg"]
@@ -168,7 +207,7 @@ def start_controller(node_name):
 
 def stop_controller(node_name):
     try:
-        response = requests.get(node_url[node_name] + "stop")
+        response = http.get(node_url[node_name] + "stop")
         if response.status_code == 200:
             res = response.json()
             return res["success"], res["msg"]
@@ -181,7 +220,7 @@ def stop_controller(node_name):
 def start_new_node(node_name):
     try:
         payload = {"node": node_name}
-        response = requests.post(start_node_api, json=payload)
+        response = http.post(start_node_api, json=payload)
         if response.status_code == 200:
             res = response.json()
             return res["success"], res["msg"]
@@ -208,193 +247,372 @@ def remove_worker(node_name):
     started_nodes.pop(index)
 
 
+def probe_node(query, node):
+    """submit query(node) without retries, or return its previous Future if that is still running"""
+    future = node_probes.get((query, node))
+    if future is None or future.done():
+        future = node_query_executor.submit(query, node, node_request_timeout, False)
+        node_probes[(query, node)] = future
+    return future
+
+
+def sample_nodes(nodes, pod_nums=None):
+    """query the pod num and maxpod of the nodes concurrently
+
+    Returns {node: (pod num, maxpod)}. A node that fails or doesn't answer within
+    sample_deadline keeps the values of its last good sample and is marked stale.
+    If pod_nums ({node: pod num}) is given, only the maxpod of each node is queried.
+    A node whose request of a previous sample is still running is not queried again.
+    """
+    pod_num_futures = {}
+    if pod_nums is None:
+        pod_num_futures = {node: probe_node(get_node_pod_num, node) for node in nodes}
+    maxpod_futures = {node: probe_node(get_max_pod, node) for node in nodes}
+    wait(
+        list(pod_num_futures.values()) + list(maxpod_futures.values()),
+        timeout=sample_deadline,
+    )
+    return record_node_samples(nodes, pod_num_futures, maxpod_futures, pod_nums, node_stats, stale_nodes)
+
+
+def record_node_samples(nodes, pod_num_answers, maxpod_answers, pod_nums, stats, stale):
+    """keep the pod num and maxpod the nodes answered, return {node: (pod num, maxpod)}
+
+    The answers are the Futures (or asyncio Tasks) of the queries of each node, those not
+    done missed the sampling deadline. A node that failed or missed it keeps its last good
+    sample in stats and is added to stale. If pod_nums ({node: pod num}) is given, the pod
+    nums are read from it instead of pod_num_answers.
+    """
+    for node in nodes:
+        pod_num_answer, maxpod_answer = pod_num_answers.get(node), maxpod_answers[node]
+        if maxpod_answer.done() and (pod_num_answer is None or pod_num_answer.done()):
+            if pod_num_answer is None:
+                pod_num, err = pod_nums.get(node, 0), None
+            else:
+                pod_num, err = pod_num_answer.result()
+            maxpod, maxpod_err = maxpod_answer.result()
+            if err is None and maxpod_err is None:
+                stats[node] = (pod_num, maxpod)
+                stale.discard(node)
+                continue
+            logging.error(
+                f"error sampling node {node}, pod num error: {err}, maxpod error: {maxpod_err}"
+            )
+        else:
+            logging.error(f"node {node} missed the {sample_deadline}s sampling deadline")
+        stale.add(node)
+        logging.warning(f"node {node} is stale, using its last sample {stats.get(node)}")
+    return {node: stats.get(node, (0, None)) for node in nodes}
+
+
+def check_started_nodes(started, running_nodes, nodes_cpu):
+    """return the started nodes to sample, and those that stopped running
+
+    A started node missing from nodes_cpu is sampled with a CPU of 0.
+    """
+    sampled, stopped = [], []
+    for node in started:
+        # detect errors
+        if node not in running_nodes:
+            logging.error(f"node started but not currently running: {node}")
+            logging.info(
+                f"removing node {node} from worker nodes because it stops accidentally"
+            )
+            append_line_to_file(
+                res_file,
+                get_current_time_string() + f"node error detected, removing {node}",
+            )
+            stopped.append(node)
+            continue
+        if node not in nodes_cpu:
+            logging.error(f"can't get node CPU, assume CPU is 0, node: {node}")
+            nodes_cpu[node] = 0
+        sampled.append(node)
+    return sampled, stopped
+
+
+def record_cluster_cpu(cur_time, sampled_nodes, nodes_cpu, sampled_stats, cpu_history):
+    """save the maxpod, pod num and CPU of the sampled nodes, add the cluster CPU to cpu_history"""
+    total_cpu = 0
+    total_pods = 0
+    cur_cluster_cpu = 0
+    for node in sampled_nodes:
+        pod_num, maxpod = sampled_stats[node]
+        total_pods += pod_num
+        # store maxpod
+        append_line_to_file(node + ".txt", f"{cur_time}, {maxpod}")
+        append_line_to_file(node+ "cur_pod.txt",f"{cur_time}, {total_pods}" )
+
+        logging.info(f"node {node} CPU: {nodes_cpu[node]}")
+        total_cpu += nodes_cpu[node] / 100
+    if sampled_nodes:
+        cur_cluster_cpu = total_cpu / len(sampled_nodes)
+        cpu_history.append(cur_cluster_cpu)
+        logging.info(f"current cluster cpu: {cur_cluster_cpu}")
+    # save number of nodes, pods and CPU
+    append_line_to_file(node_num_file, f"{cur_time}, {len(sampled_nodes)}")
+    append_line_to_file(pod_num_file, f"{cur_time}, {total_pods}")
+    append_line_to_file(cpu_file, f"{cur_time}, {cur_cluster_cpu}")
+
+
+def log_client_stats(cur_time, latency, assignments):
+    """every latency_log_time seconds, log the endpoint latency and the job assignment counts"""
+    if cur_time % latency_log_time == 0:
+        logging.info(f"endpoint latency: {latency.latency_stats()}")
+        logging.info(f"job assignments: {assignments}")
+
+
 def sample_cpu():
     """sample the cluster CPU"""
     global sample_time, started_nodes, cluster_cpu
     cur_time = 0
     while True:
-        running_nodes, err = get_nodes()
-        logging.debug(f"running nodes: {running_nodes}")
-        if err != None:
-            logging.critical(f"error getting nodes, msg: {err}")
-            time.sleep(sample_time)
-            continue
-        nodes_cpu, err = get_cpu()
-        logging.debug(f"nodes_cpu: {nodes_cpu}")
-        if err != None:
-            logging.critical(f"error getting nodes cpu, msg: {err}")
-            time.sleep(sample_time)
-            continue
-        total_cpu = 0
-        num = 0
-        total_pods = 0
-        for node in started_nodes:
-            # detect errors
-            if node not in running_nodes:
-                logging.error(f"node started but not currently running: {node}")
-                logging.info(
-                    f"removing node {node} from worker nodes because it stops accidentally"
-                )
-                append_line_to_file(
-                    res_file,
-                    get_current_time_string() + f"node error detected, removing {node}",
-                )
-                remove_worker(node)
+        pod_nums = None
+        state = cluster_stream.snapshot() if use_stream else None
+        if state is not None:
+            running_nodes, nodes_cpu, pod_nums = state["nodes"], state["cpu"], state["pod_num"]
+            logging.debug(f"running nodes: {running_nodes}")
+            logging.debug(f"nodes_cpu: {nodes_cpu}")
+        elif use_cluster_state:
+            state, err = get_cluster_state()
+            if err != None:
+                logging.critical(f"error getting the cluster state, msg: {err}")
+                time.sleep(sample_time)
                 continue
-            if node not in nodes_cpu:
-                logging.error(f"can't get node CPU, assume CPU is 0, node: {node}")
-                nodes_cpu[node] = 0
-            # get pod num
-            pod_num, _ = get_node_pod_num(node)
-            total_pods += pod_num
-            # get and store maxpod
-            maxpod, _ = get_max_pod(node)
-            append_line_to_file(node + ".txt", f"{cur_time}, {maxpod}")
-            append_line_to_file(node+ "cur_pod.txt",f"{cur_time}, {total_pods}" )
-
-            logging.info(f"node {node} CPU: {nodes_cpu[node]}")
-            total_cpu += nodes_cpu[node] / 100
-            num += 1
-        if num != 0:
-            cur_cluster_cpu = total_cpu / num
-            cluster_cpu.append(cur_cluster_cpu)
-            logging.info(f"current cluster cpu: {cur_cluster_cpu}")
-        # save number of nodes, pods and CPU
-        append_line_to_file(node_num_file, f"{cur_time}, {num}")
-        append_line_to_file(pod_num_file, f"{cur_time}, {total_pods}")
-        append_line_to_file(cpu_file, f"{cur_time}, {cur_cluster_cpu}")
+            running_nodes, nodes_cpu, pod_nums = state["nodes"], state["cpu"], state["pod_num"]
+            logging.debug(f"running nodes: {running_nodes}")
+            logging.debug(f"nodes_cpu: {nodes_cpu}")
+        else:
+            running_nodes, err = get_nodes()
+            logging.debug(f"running nodes: {running_nodes}")
+            if err != None:
+                logging.critical(f"error getting nodes, msg: {err}")
+                time.sleep(sample_time)
+                continue
+            nodes_cpu, err = get_cpu()
+            logging.debug(f"nodes_cpu: {nodes_cpu}")
+            if err != None:
+                logging.critical(f"error getting nodes cpu, msg: {err}")
+                time.sleep(sample_time)
+                continue
+        sampled_nodes, stopped_nodes = check_started_nodes(list(started_nodes), running_nodes, nodes_cpu)
+        for node in stopped_nodes:
+            remove_worker(node)
+        # get pod num and maxpod of all nodes at once
+        sampled_stats = sample_nodes(sampled_nodes, pod_nums)
+        record_cluster_cpu(cur_time, sampled_nodes, nodes_cpu, sampled_stats, cluster_cpu)
+        log_client_stats(cur_time, http, assign_stats)
         time.sleep(sample_time)
         cur_time += sample_time
 
 
-def controller():
-    """make scaling up of scaling down decision"""
-    global started_nodes, cluster_cpu, number_cpu_data_used, cpu_bar, last_started_time
-    while True:
-        ave_cluster_cpu = None
-        if len(cluster_cpu) < number_cpu_data_used:
-            logging.info("not enough CPU data, skip scaling up")
-            time.sleep(loop_sleep_time)
-            continue
-        else:
-            cpu_data = cluster_cpu[-number_cpu_data_used:]
-            ave_cluster_cpu = sum(cpu_data) / number_cpu_data_used
-        if ave_cluster_cpu > cpu_bar:
-            # scale up
-            if len(started_nodes) == len(worker_nodes) + 1:
-                logging.info("all nodes started, won't scale up")
+def controller_step(now=None):
+    """make one scaling up or scaling down decision
+
+    now defaults to datetime.now(), the simulator passes its own clock.
+    """
+    global started_nodes, cluster_cpu, last_started_time
+    if now is None:
+        now = datetime.now()
+    ave_cluster_cpu = average_cluster_cpu(cluster_cpu)
+    if ave_cluster_cpu is None:
+        return
+    new_node = scale_up_node(ave_cluster_cpu, started_nodes, worker_nodes)
+    if new_node is not None:
+        ok, err = start_new_node(new_node)
+        if ok:
+            ok, msg = start_controller(new_node)
+            if ok:
+                started_nodes.append(new_node)
+                record_scale_up(new_node, cluster_cpu)
+                last_started_time = now
             else:
-                logging.info(
-                    f"current cluster average {ave_cluster_cpu}, greater than {cpu_bar}, scaling up"
+                logging.error(
+                    f"error trying to start the controller for node {new_node}, msg: {msg}"
                 )
-                new_node = worker_nodes[
-                    len(started_nodes) - 1
-                ]  # master node is always started
-                ok, err = start_new_node(new_node)
-                if ok:
-                    ok, msg = start_controller(new_node)
-                    if ok:
-                        started_nodes.append(new_node)
-                        logging.info(f"added new node {new_node} for scaling up")
-                        append_line_to_file(
-                            res_file,
-                            get_current_time_string()
-                            + f"scaled up by adding new node {new_node}",
-                        )
-                        cluster_cpu = []  # reset the cluster CPU data
-                        last_started_time = datetime.now()
-                    else:
-                        logging.error(
-                            f"error trying to start the controller for node {new_node}, msg: {msg}"
-                        )
-                else:
-                    logging.error(f"error trying to start node {new_node}, msg: {err}")
         else:
-            logging.info(
-                f"current cluster average {ave_cluster_cpu}, less than {cpu_bar}, not scaling up"
-            )
-        # scaling down decision
-        if (
-            datetime.now() - last_started_time
-        ).total_seconds() > node_start_delay and len(started_nodes) > 1:
-            # check last node jobs, if it's zero, delete it
-            target_node = started_nodes[-1]
-
-            # check node pod num
-            pod_num, err = get_node_pod_num(target_node)
-            if pod_num is None:
-                logging.error(f"error getting pod num for node {target_node}")
+            logging.error(f"error trying to start node {new_node}, msg: {err}")
+    # scaling down decision
+    target_node = scale_down_node(now, last_started_time, started_nodes)
+    if target_node is not None:
+        # check node pod num
+        pod_num, err = get_node_pod_num(target_node)
+        if node_is_empty(target_node, pod_num, err):
+            ok, e = delete_node(target_node)
+            if not ok:
+                logging.error(
+                    f"error when deleting node {target_node}, error: {e}"
+                )
             else:
-                if pod_num == 0:
-                    ok, e = delete_node(target_node)
-                    if not ok:
-                        logging.error(
-                            f"error when deleting node {target_node}, error: {e}"
-                        )
-                    else:
-                        ok, msg = stop_controller(target_node)
-                        started_nodes.pop()
-                        logging.info(f"scaling down: deleted node {target_node}")
-                        append_line_to_file(
-                            res_file,
-                            get_current_time_string()
-                            + f"scaled down by deleting node {target_node}",
-                        )
-                        if not ok:
-                            logging.error(
-                                f"error when stopping controller of the deleted node {target_node}, error: {msg}"
-                            )
-                else:
+                ok, msg = stop_controller(target_node)
+                started_nodes.remove(target_node)
+                record_scale_down(target_node)
+                if not ok:
                     logging.error(
-                        f"node {target_node} pod num {pod_num}, won't be deleted"
+                        f"error when stopping controller of the deleted node {target_node}, error: {msg}"
                     )
-        time.sleep(loop_sleep_time)
 
 
-def assign_job(job, node_name):
-    """try to assign a job to a node
+def average_cluster_cpu(cpu_history):
+    """return the mean of the last number_cpu_data_used cluster CPU samples, None if there are fewer"""
+    if len(cpu_history) < number_cpu_data_used:
+        logging.info("not enough CPU data, skip scaling up")
+        return None
+    return cpu_history.mean(number_cpu_data_used)
+
+
+def scale_up_node(ave_cluster_cpu, started, workers):
+    """return the worker node to start, None if the cluster CPU is under cpu_bar or all nodes are started"""
+    if ave_cluster_cpu <= cpu_bar:
+        logging.info(
+            f"current cluster average {ave_cluster_cpu}, less than {cpu_bar}, not scaling up"
+        )
+        return None
+    if len(started) == len(workers) + 1:
+        logging.info("all nodes started, won't scale up")
+        return None
+    logging.info(
+        f"current cluster average {ave_cluster_cpu}, greater than {cpu_bar}, scaling up"
+    )
+    return workers[len(started) - 1]  # master node is always started
 
-    Args:
-        job (_type_): _description_
-        node (_type_): _description_
+
+def scale_down_node(now, last_started, started):
+    """return the last started node, the one to delete if it has no pods, or None
+
+    No node is deleted within node_start_delay seconds of a scaling up, nor the master node.
     """
+    if (now - last_started).total_seconds() > node_start_delay and len(started) > 1:
+        return started[-1]
+    return None
+
+
+def node_is_empty(node, pod_num, err):
+    """tell from its pod num, or the error getting it, whether a node can be deleted"""
+    if pod_num is None:
+        logging.error(f"error getting pod num for node {node}: {err}")
+        return False
+    if pod_num != 0:
+        logging.error(f"node {node} pod num {pod_num}, won't be deleted")
+        return False
+    return True
+
+
+def record_scale_up(new_node, cpu_history):
+    logging.info(f"added new node {new_node} for scaling up")
+    append_line_to_file(
+        res_file,
+        get_current_time_string() + f"scaled up by adding new node {new_node}",
+    )
+    cpu_history.clear()  # reset the cluster CPU data
+
+
+def record_scale_down(node):
+    logging.info(f"scaling down: deleted node {node}")
+    append_line_to_file(
+        res_file,
+        get_current_time_string() + f"scaled down by deleting node {node}",
+    )
+
+
+def controller():
+    """make scaling up of scaling down decision"""
+    while True:
+        controller_step()
+        time.sleep(loop_sleep_time)
+
+
+def assign_jobs(jobs, node_name):
+    """try to assign a batch of jobs to a node with one request, return [(ok, msg)] per job"""
     try:
-        unique_pod_name = f"pod-{uuid.uuid4().hex[:8]}"
-        payload = {"node": node_name, "job": job, "name": unique_pod_name}
-        response = requests.post(node_job_api[node_name], json=payload)
+        payload = {"jobs": [job.to_dict() for job in jobs]}
+        response = http.post(node_jobs_api[node_name], json=payload)
         if response.status_code == 200:
             res = response.json()
-            return res["success"], res["msg"]
+            if len(res["results"]) != len(jobs):
+                return [(False, res["msg"])] * len(jobs)
+            return [(result["success"], result["msg"]) for result in res["results"]]
         else:
-            return False, f"Error: {response.status_code}"
+            return [(False, f"Error: {response.status_code}")] * len(jobs)
     except Exception as e:
-        return False, e
+        return [(False, e)] * len(jobs)
+
+
+def get_placement_stats(started, stats, stale):
+    """return {node: (pod num, maxpod)} of the started nodes with a fresh sample, in started order
+
+    stats and stale are the last samples of the nodes, see record_node_samples.
+    """
+    placement_stats = {}
+    for node in list(started):
+        pod_num, maxpod = stats.get(node, (0, None))
+        if maxpod is None or node in stale:
+            continue
+        placement_stats[node] = (pod_num, maxpod)
+    return placement_stats
+
+
+def plan_batches(queue, placement_stats):
+    """place the queued jobs by placement_policy, return {node: queued jobs placed on it}"""
+    batches = {}
+    for entry, node in plan_dispatch(queue, placement_stats, placement_policy):
+        batches.setdefault(node, []).append(entry)
+    return batches
+
+
+def dispatch_jobs():
+    """send as many queued jobs as the started nodes have room for, concurrently
+
+    Each job is placed by placement_policy on the cached pod num and maxpod of the nodes, and
+    the jobs of a node are sent as one batch, so a tick costs one POST per node that gets jobs.
+    Returns the number of jobs dispatched. A job a node refused goes back to the queue.
+    """
+    batches = plan_batches(job_queue, get_placement_stats(started_nodes, node_stats, stale_nodes))
+    futures = {
+        node: job_dispatch_executor.submit(assign_jobs, [entry.job for entry in entries], node)
+        for node, entries in batches.items()
+    }
+    dispatched = 0
+    for node, entries in batches.items():
+        for entry, (ok, err) in zip(entries, futures[node].result()):
+            if record_assignment(entry, node, ok, err, node_stats, job_queue, assign_stats):
+                dispatched += 1
+    return dispatched
+
+
+def record_assignment(entry, node, ok, err, stats, queue, counts):
+    """log the answer of a node to a queued job, and requeue the job if it was refused
+
+    An assigned job is counted in the node's pod num in stats until the next sample, and the
+    sent and failed job POSTs in counts, see assign_stats.
+    """
+    counts["sent"] += 1
+    if ok:
+        logging.info(f"assigned job {entry.job} to node {node}")
+        append_line_to_file(
+            res_file,
+            get_current_time_string() + f"assigned job {entry.job} to node {node}",
+        )
+        # count the pod until the next sample sees it
+        pod_num, maxpod = stats[node]
+        stats[node] = (pod_num + 1, maxpod)
+        return True
+    counts["failed"] += 1
+    logging.info(f"can't assign job {entry.job} to node {node}, because {err}")
+    if not queue.retry(entry):
+        logging.error(f"dropping job {entry.job} after {entry.attempts} failed attempts")
+        append_line_to_file(
+            res_file,
+            get_current_time_string() + f"dropped job {entry.job}",
+        )
+    return False
 
 
 def job_scheduling():
-    global job_list
-    while job_list:
-        job = job_list[0]
-        job_assigned = False
-        for node in started_nodes:
-            ok, err = assign_job(job, node)
-            if not ok:
-                logging.info(f"can't assign job {job} to node {node}, because {err}")
-            else:
-                logging.info(f"assigned job {job} to node {node}")
-                append_line_to_file(
-                    res_file,
-                    get_current_time_string() + f"assigned job {job} to node {node}",
-                )
-                job_assigned = True
-                break
-        if not job_assigned:
-            logging.info(
-                f"job {job} can't be assigned, will try to assign the job in the next iteration"
-            )
-        else:
-            job_list = job_list[1:]
+    while len(job_queue) != 0:
+        dispatch_jobs()
         time.sleep(job_assign_time)
+    logging.info("all jobs assigned")
 
 
 def get_current_time_string():
@@ -451,10 +669,15 @@ if __name__ == "__main__":
         logging.critical(f"error getting the job list: {error}")
         logging.critical("shutting down")
         exit(0)
+    logging.info(f"queued {load_jobs(job_queue, job_list)} jobs")
 
     # sample_cpu()
     # job_scheduling()
 
+    if use_stream:
+        logging.info(f"subscribing to the metrics stream: {stream_api}")
+        cluster_stream.start()
+
     # start CPU sampling
     logging.info("start sampling")
     sample_cpu_thread = threading.Thread(target=sample_cpu)
@@ -0,0 +1,54 @@
+import bisect
+import threading
+
+# upper bounds in seconds of the default latency buckets, the last bucket is unbounded
+latency_buckets = [0.5, 1, 2, 3, 5, 8, 10, 15, 20, 30, 45, 60, 90, 120, 300]
+
+
+class Histogram:
+    """Histogram of durations in fixed buckets, with their count, sum and max.
+
+    observe() is O(log buckets) and memory is constant. quantile() answers with the upper
+    bound of the bucket holding the quantile, an overestimate by at most one bucket width.
+    """
+
+    def __init__(self, buckets=None):
+        self.buckets = list(latency_buckets if buckets is None else buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # the last count is above every bound
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        with self.lock:
+            self.counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.count += 1
+            self.sum += value
+            self.max = max(self.max, value)
+
+    def quantile(self, q):
+        """Return the upper bound of the bucket holding the q quantile (max for the last one), None if empty."""
+        with self.lock:
+            if self.count == 0:
+                return None
+            target = q * self.count
+            seen = 0
+            for bound, count in zip(self.buckets, self.counts):
+                seen += count
+                if seen >= target:
+                    return min(bound, self.max)
+            return self.max
+
+    def snapshot(self):
+        """Return {"buckets": {upper bound: count}, "count", "sum", "mean", "max"}, "+Inf" is the last bucket."""
+        with self.lock:
+            buckets = {str(bound): count for bound, count in zip(self.buckets, self.counts)}
+            buckets["+Inf"] = self.counts[-1]
+            return {
+                "buckets": buckets,
+                "count": self.count,
+                "sum": self.sum,
+                "mean": self.sum / self.count if self.count else None,
+                "max": self.max,
+            }
@@ -0,0 +1,205 @@
+import json
+import logging
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class LatencyStats:
+    """Number of calls, mean and max latency and number of errors of every URL called."""
+
+    def __init__(self):
+        self.latency = {}  # url -> [number of calls, total seconds, max seconds, number of errors]
+        self.lock = threading.Lock()
+
+    def record(self, url, elapsed, error):
+        with self.lock:
+            stats = self.latency.setdefault(url, [0, 0.0, 0.0, 0])
+            stats[0] += 1
+            stats[1] += elapsed
+            stats[2] = max(stats[2], elapsed)
+            if error:
+                stats[3] += 1
+
+    def latency_stats(self):
+        """Return {url: {"count", "mean", "max", "errors"}} with latencies in seconds."""
+        with self.lock:
+            return {
+                url: {
+                    "count": count,
+                    "mean": total / count,
+                    "max": max_elapsed,
+                    "errors": errors,
+                }
+                for url, (count, total, max_elapsed, errors) in self.latency.items()
+            }
+
+
+def read_event_line(line, data):
+    """Add a Server-Sent Events line to data, the lines of the current event.
+
+    Returns the JSON payload of the event once its closing blank line is read, else None.
+    """
+    if line.startswith("data:"):
+        data.append(line[5:].strip())
+    elif line == "" and data:
+        payload = json.loads("\n".join(data))
+        data.clear()
+        return payload
+    return None
+
+
+class HttpClient(LatencyStats):
+    """HTTP client shared by the controllers for their calls to the middleware and to each other.
+
+    Keeps one keep-alive Session per endpoint (scheme://host:port), applies connect/read
+    timeouts to every call, retries idempotent calls on connection errors and timeouts
+    with jittered exponential backoff, and records the latency of every URL.
+    """
+
+    def __init__(self, connect_timeout=1, read_timeout=5, retries=2, backoff=0.2, pool_size=4):
+        super().__init__()
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.pool_size = pool_size
+        self.sessions = {}
+
+    def session(self, url):
+        """Return the Session of the endpoint serving url, creating it on first use."""
+        parts = urlsplit(url)
+        endpoint = f"{parts.scheme}://{parts.netloc}"
+        with self.lock:
+            session = self.sessions.get(endpoint)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+                session.mount(endpoint, adapter)
+                self.sessions[endpoint] = session
+            return session
+
+    def request(self, method, url, retry=False, timeout=None, **kwargs):
+        """Send a request, retrying connection errors and timeouts only if retry is set."""
+        if timeout is None:
+            timeout = (self.connect_timeout, self.read_timeout)
+        session = self.session(url)
+        attempts = 1 + self.retries if retry else 1
+        for attempt in range(attempts):
+            start = time.monotonic()
+            try:
+                response = session.request(method, url, timeout=timeout, **kwargs)
+                self.record(url, time.monotonic() - start, False)
+                return response
+            except (requests.ConnectionError, requests.Timeout) as e:
+                self.record(url, time.monotonic() - start, True)
+                if attempt == attempts - 1:
+                    raise
+                delay = self.backoff * (2**attempt) * random.uniform(0.5, 1.5)
+                logging.warning(f"{method} {url} failed: {e}, retrying in {delay:.2f}s")
+                time.sleep(delay)
+
+    def get(self, url, retry=True, **kwargs):
+        """GET url, retried unless retry is False (e.g. a probe bounded by its own timeout)."""
+        return self.request("GET", url, retry=retry, **kwargs)
+
+    def post(self, url, idempotent=False, **kwargs):
+        """POST to url, only retried when the call is idempotent (e.g. a read sent as POST)."""
+        return self.request("POST", url, retry=idempotent, **kwargs)
+
+    def stream_events(self, url, read_timeout=60, **kwargs):
+        """Yield the JSON payload of each Server-Sent Event sent by url, until the stream ends."""
+        session = self.session(url)
+        with session.get(
+            url, stream=True, timeout=(self.connect_timeout, read_timeout), **kwargs
+        ) as response:
+            response.raise_for_status()
+            data = []
+            for line in response.iter_lines(decode_unicode=True):
+                event = read_event_line(line, data)
+                if event is not None:
+                    yield event
+
+
+class ClusterStateStream:
+    """Copy of the middleware /cluster-state kept up to date from its /stream endpoint.
+
+    A daemon thread applies every event to the copy, calls on_event(event) and sets the
+    `updated` Event; it reconnects after retry_delay seconds whenever the stream breaks.
+    """
+
+    keys = ["cpu", "memory", "metrics_timestamp", "metrics_window", "pod_num"]  # per-node maps of the state
+
+    def __init__(self, client, url, on_event=None, retry_delay=1):
+        self.client = client
+        self.url = url
+        self.on_event = on_event
+        self.retry_delay = retry_delay
+        self.state = None
+        self.deleted_seq = None  # latest reaped pod sequence number received, resumed on reconnect
+        self.updated_at = None  # time.monotonic() of the last event applied, None while disconnected
+        self.updated = threading.Event()
+        self.lock = threading.Lock()
+
+    def start(self):
+        thread = threading.Thread(target=self.run)
+        thread.daemon = True
+        thread.start()
+
+    def run(self):
+        while True:
+            try:
+                for event in self.client.stream_events(self.url, params=self.params()):
+                    self.receive(event)
+                logging.warning(f"stream {self.url} ended, reconnecting")
+            except Exception as e:
+                logging.error(f"stream {self.url} failed: {e}, reconnecting in {self.retry_delay}s")
+            self.disconnected()
+            time.sleep(self.retry_delay)
+
+    def params(self):
+        """Query parameters of a (re)connection, resuming after the last reaped pod received."""
+        return {} if self.deleted_seq is None else {"since": self.deleted_seq}
+
+    def receive(self, event):
+        self.apply(event)
+        if self.on_event is not None:
+            self.on_event(event)
+        self.updated.set()
+
+    def disconnected(self):
+        with self.lock:
+            self.state = None
+            self.updated_at = None
+
+    def apply(self, event):
+        with self.lock:
+            if self.state is None:
+                self.state = {key: {} for key in self.keys}
+                self.state["nodes"] = []
+            if "nodes" in event:
+                self.state["nodes"] = event["nodes"]
+                for key in self.keys:
+                    for node in list(self.state[key]):
+                        if node not in event["nodes"]:
+                            self.state[key].pop(node)
+            for key in self.keys:
+                self.state[key].update(event.get(key, {}))
+            self.state["timestamp"] = event["timestamp"]
+            self.deleted_seq = event["deleted_seq"]
+            self.updated_at = time.monotonic()
+
+    def snapshot(self):
+        """Return a copy of the current state, or None while the stream is not connected."""
+        with self.lock:
+            if self.state is None:
+                return None
+            return {
+                "nodes": list(self.state["nodes"]),
+                **{key: dict(self.state[key]) for key in self.keys},
+                "timestamp": self.state["timestamp"],
+            }
@@ -0,0 +1,142 @@
+import re
+
+# settings, demand estimates of the stress-ng workers
+cores_per_cpu_worker = 1.0  # cores used by one --cpu worker
+cores_per_io_worker = 0.05  # cores used by one --io worker, mostly waiting on I/O
+cores_per_vm_worker = 0.8  # cores used by one --vm worker
+default_vm_bytes = "1G"  # stress-ng --vm-bytes used when a job sets --vm without it
+
+# "--name value" options, and the "-- cpu N" token written by generate_jobs.py; a value may be
+# negative ("--cpu -1", rejected by parse_job) but not another option
+option_pattern = re.compile(r"--\s?([a-zA-Z-]+)\s+(-?[^\s-][^\s]*)")
+worker_options = ("cpu", "io", "vm")
+units = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+byte_units = {"b": 1, "k": 1024, "m": 1024**2, "g": 1024**3, "t": 1024**4}
+
+
+class Job:
+    """A stress-ng job description parsed once into its workers, timeout and demand estimate.
+
+    Jobs travel between the controllers and the middleware as to_dict() payloads, so they are
+    parsed once, when the job file is loaded.
+    """
+
+    __slots__ = ("description", "cpu", "io", "vm", "vm_bytes", "timeout")
+
+    def __init__(self, description, timeout, cpu=0, io=0, vm=0, vm_bytes=default_vm_bytes):
+        self.description = description
+        self.cpu = cpu  # stress-ng --cpu workers
+        self.io = io  # stress-ng --io workers
+        self.vm = vm  # stress-ng --vm workers
+        self.vm_bytes = vm_bytes  # stress-ng --vm-bytes of each vm worker, e.g. "2G"
+        self.timeout = timeout  # stress-ng --timeout, e.g. "137s"
+
+    def __str__(self):
+        return self.description
+
+    def __repr__(self):
+        return f"Job({self.description!r})"
+
+    @property
+    def cores(self):
+        """estimated number of cores the job keeps busy"""
+        return (
+            self.cpu * cores_per_cpu_worker
+            + self.io * cores_per_io_worker
+            + self.vm * cores_per_vm_worker
+        )
+
+    @property
+    def duration(self):
+        """run time in seconds"""
+        return parse_duration(self.timeout)
+
+    @property
+    def memory(self):
+        """estimated memory in bytes used by the vm workers, None if vm_bytes is a percentage"""
+        vm_bytes = parse_bytes(self.vm_bytes)
+        return None if vm_bytes is None else self.vm * vm_bytes
+
+    def stress_args(self):
+        """arguments of the stress-ng command running the job"""
+        args = []
+        if self.cpu:
+            args.extend(["--cpu", str(self.cpu)])
+        if self.io:
+            args.extend(["--io", str(self.io)])
+        if self.vm:
+            args.extend(["--vm", str(self.vm), "--vm-bytes", self.vm_bytes])
+        args.extend(["--timeout", self.timeout])
+        return args
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, data):
+        """build a Job from a to_dict() payload, raise ValueError, TypeError or IndexError if a field is invalid"""
+        fields = {name: data[name] for name in cls.__slots__ if name in data}
+        for name in worker_options:
+            if name in fields:
+                fields[name] = int(fields[name])
+        job = cls(**fields)
+        check_workers(job)
+        parse_duration(job.timeout)  # the timeout must be a valid duration
+        return job
+
+
+def check_workers(job):
+    """raise ValueError if a worker count of the job is negative"""
+    for name in worker_options:
+        if getattr(job, name) < 0:
+            raise ValueError(f"--{name} must not be negative, got {getattr(job, name)}")
+
+
+def parse_job(description):
+    """parse a stress-ng job description, return (Job, error)"""
+    options = dict(option_pattern.findall(description))
+    if "timeout" not in options:
+        return None, f"job has no --timeout: {description}"
+    try:
+        job = Job(
+            description,
+            options["timeout"],
+            cpu=int(options.get("cpu", 0)),
+            io=int(options.get("io", 0)),
+            vm=int(options.get("vm", 0)),
+            vm_bytes=options.get("vm-bytes", default_vm_bytes),
+        )
+        check_workers(job)
+        parse_duration(options["timeout"])  # the timeout must be a valid duration
+    except (ValueError, KeyError) as e:
+        return None, f"invalid job {description}: {e}"
+    return job, None
+
+
+def job_from_payload(value):
+    """return (Job, error) from the "job" field of a request, a to_dict() payload or a description"""
+    if isinstance(value, dict):
+        try:
+            return Job.from_dict(value), None
+        except (TypeError, ValueError, IndexError) as e:
+            return None, f"invalid job {value}: {e}"
+    if isinstance(value, str):
+        return parse_job(value)
+    return None, f"invalid job {value}"
+
+
+def parse_duration(value):
+    """convert a stress-ng timeout ("137s", "4m", "1h", "2d" or plain seconds) to seconds"""
+    if value[-1] in units:
+        return float(value[:-1]) * units[value[-1]]
+    return float(value)
+
+
+def parse_bytes(value):
+    """convert a stress-ng size ("512M", "2G" or plain bytes) to bytes, None for a percentage"""
+    if value.endswith("%"):
+        return None
+    unit = value[-1].lower()
+    if unit in byte_units:
+        return int(float(value[:-1]) * byte_units[unit])
+    return int(value)
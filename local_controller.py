@@ -0,0 +1,877 @@
+import os
+import time
+import threading
+from fastapi import FastAPI, Request
+from fastapi.concurrency import run_in_threadpool
+import logging
+from collections import deque
+from datetime import datetime
+from histogram import Histogram
+from http_client import ClusterStateStream, HttpClient
+from jobs import job_from_payload, parse_job
+from recorder import TimeSeriesRecorder
+from ring_buffer import RingBuffer
+
+# Initialize FastAPI app
+app = FastAPI()
+
+# Initialize logging
+logging.basicConfig(level=logging.DEBUG, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
+#controller values
+pid_kp = -1.7
+pid_ki = 1.8
+pid_kd= 1.3
+
+# Threshold and PID settings
+node_names = ["node0", "node1", "node2"]  # nodes controlled by this process, others are added when started
+sample_rate = 5  # The closed loop system will sleep for this much of X seconds
+reference_input = 0.8  # CPU usage, from 0 to 1, of every node until set by /nodes/{name}/reference-input
+job_sleep_time = 15  # read a job every X seconds
+job_file_name = "job_list.txt"
+job_node = "node0"  # node the jobs of job_file_name are rendered on
+record_file_name = "controller_record.csv"  # CPU, max_pod, pod_num, error and PID output of every sample, one file per node
+record_batch_size = 12  # number of samples buffered before they are appended to the record file
+record_flush_time = 60  # every X seconds, append the buffered samples even if the batch isn't full
+record_max_bytes = 10 * 1024 * 1024  # rotate the record file once it is larger than X bytes
+record_max_age = None  # rotate the record file every X seconds, if set
+history_size = 720  # number of CPU and max_pod samples kept in memory per node, the full history is in the record file
+max_pod_upperbound = 7
+skip_stale_samples = True  # run the PID only on a new metrics-server sample, using the time between samples as dt
+max_pid_dt = 60  # upper bound of that dt, so a gap in the metrics can't wind up the integral term
+job_delay = 15  # number of seconds that we believe a the CPU is changed after a job is started, i.e., we need to wait at least that time before we start the closed loop function
+read_jobs_flag = False  # if read a job from a file and render the jobs
+adaptive_job_delay = False  # replace job_delay by the measured time the CPU of the node takes to respond to a job started or finished
+job_delay_quantile = 0.9  # quantile of the measured CPU response times used as job delay
+job_delay_min = 5  # bounds of the adaptive job delay, in seconds
+job_delay_max = 60
+job_delay_min_samples = 10  # number of CPU responses measured before job_delay is replaced
+cpu_response_threshold = 0.02  # CPU change, from 0 to 1, counted as the response to a job started or finished
+cpu_response_timeout = 120  # stop waiting for the CPU response of a job after X seconds
+# global variables
+nodes = {}  # node name -> NodeController
+nodes_lock = threading.Lock()
+
+#apis
+cpu_api = "http://128.110.217.103:5001/cpu"
+pod_num_api = "http://128.110.217.103:5001/pod-num"
+create_pod_api = "http://128.110.217.103:5001/pod"
+create_pods_api = "http://128.110.217.103:5001/pods"
+cluster_state_api = "http://128.110.217.103:5001/cluster-state"
+pod_cpu_api = "http://128.110.217.103:5001/pod-cpu"
+subtract_baseline_cpu = False  # control the CPU used by the job pods only, the CPU of everything else on the node is subtracted before computing err
+use_cluster_state = True  # read CPU and pod num of every node from /cluster-state instead of /cpu and /pod-num
+cluster_state_max_age = 1  # a /cluster-state snapshot is reused for X seconds
+pod_watch_lag = 1  # seconds the pod count of the middleware may lag behind a pod creation
+created_pods_memory = 60  # created pods are remembered X seconds, longer than any snapshot age plus pod_watch_lag
+cluster_state = None  # last /cluster-state snapshot
+cluster_state_time = None  # time.monotonic() when the request of cluster_state was sent
+deleted_seq = 0  # latest reaped pod sequence number already seen in /cluster-state
+cluster_state_lock = threading.Lock()
+stream_api = "http://128.110.217.103:5001/stream"
+use_stream = False  # subscribe to /stream, the closed loop then also runs as soon as a node CPU changes
+cpu_updated = threading.Event()  # set by the stream when the CPU of a controlled node changes
+
+# http client settings
+http_connect_timeout = 1  # seconds to wait for a connection to the middleware
+http_read_timeout = 5  # seconds to wait for a response once connected
+http_retries = 2  # number of retries of a failed idempotent call
+http = HttpClient(
+    connect_timeout=http_connect_timeout,
+    read_timeout=http_read_timeout,
+    retries=http_retries,
+)
+
+
+def handle_stream_event(event):
+    for name, deleted_pods in event.get("deleted_pods", {}).items():
+        node = nodes.get(name)
+        if node is not None and len(deleted_pods) != 0:
+            node.last_pod_finish_time = datetime.now()
+    if any(name in nodes for name in [*event.get("cpu", {}), *event.get("metrics_timestamp", {})]):
+        cpu_updated.set()
+
+
+metrics_stream = ClusterStateStream(http, stream_api, on_event=handle_stream_event)
+
+
+# Helper Functions
+
+
+def read_file_to_list(file_path):
+    """read a file, return a list of strings(each line)
+    """
+    try:
+        with open(file_path, 'r') as file:
+            lines = file.readlines()
+        # Strip newline characters from each line
+        lines = [line.strip() for line in lines]
+        return lines, None
+    except FileNotFoundError:
+        return [], "The file was not found."
+    except Exception as e:
+        return [], e
+
+
+def get_cluster_state():
+    """get a snapshot of the cluster, reusing the last one if it's recent enough"""
+    global cluster_state, cluster_state_time, deleted_seq
+    with cluster_state_lock:
+        if cluster_state is not None and time.monotonic() - cluster_state_time < cluster_state_max_age:
+            return cluster_state, None
+        try:
+            requested = time.monotonic()
+            response = http.get(cluster_state_api, params={"since": deleted_seq})
+            if response.status_code == 200:
+                res = response.json()
+                if res["success"]:
+                    cluster_state, cluster_state_time = res, requested
+                    # a reused snapshot only reports its deleted pods once
+                    if res["deleted_seq"] > deleted_seq:
+                        for name, deleted_pods in res["deleted_pods"].items():
+                            node = nodes.get(name)
+                            if node is not None and len(deleted_pods) != 0:
+                                node.last_pod_finish_time = datetime.now()
+                        deleted_seq = res["deleted_seq"]
+                    return res, None
+                else:
+                    return None, f"Error: {res['msg']}"
+            else:
+                return None, f"Error: {response.status_code}"
+        except Exception as e:
+            return None, e
+
+
+def get_metrics(names):
+    """get the CPU usage and pod number of the given nodes, with one cluster-wide fetch
+
+    Returns ({node: CPU}, {node: pod num}, {node: metrics timestamp}, err). A node the
+    middleware has no CPU for is left out of the CPU dict, and one without a metrics-server
+    timestamp out of the timestamp dict.
+    """
+    if use_stream:
+        state = metrics_stream.snapshot()
+        if state is not None:
+            # finished pods are reported by handle_stream_event
+            cpu = {name: state["cpu"][name] / 100 for name in names if name in state["cpu"]}
+            return cpu, {name: state["pod_num"].get(name, 0) for name in names}, get_timestamps(state, names), None
+        # not connected yet, fall back to polling
+    if use_cluster_state:
+        state, msg = get_cluster_state()
+        if msg is not None:
+            return {}, {}, {}, msg
+        cpu = {name: state["cpu"][name] / 100 for name in names if name in state["cpu"]}
+        return cpu, {name: state["pod_num"].get(name, 0) for name in names}, get_timestamps(state, names), None
+    try:
+        # with memory=true /cpu also returns the metrics-server timestamps
+        response = http.get(cpu_api, params={"memory": "true"})
+        if response.status_code != 200:
+            return {}, {}, {}, f"Error: {response.status_code}"
+        usage = response.json()
+        cpu = {name: usage["cpu"][name] / 100 for name in names if name in usage["cpu"]}
+        timestamps = get_timestamps(usage, names)
+        pod_num = {}
+        for name in names:
+            # with since the call is a read, safe to retry: the pods reaped after it are sent again
+            node = nodes[name]
+            response = http.post(pod_num_api, idempotent=True, json={"node": name, "since": node.deleted_seq})
+            if response.status_code != 200:
+                return cpu, pod_num, timestamps, f"Error: {response.status_code}"
+            res = response.json()
+            if len(res["deleted_pods"]) != 0:
+                node.last_pod_finish_time = datetime.now()
+            node.deleted_seq = max(node.deleted_seq, res["deleted_seq"])
+            pod_num[name] = res["pod_num"]
+        return cpu, pod_num, timestamps, None
+    except Exception as e:
+        return {}, {}, {}, e
+
+
+def get_timestamps(state, names):
+    """metrics-server timestamps of the CPU values of a cluster state, the middleware may not report them"""
+    timestamps = state.get("metrics_timestamp", {})
+    return {name: timestamps[name] for name in names if timestamps.get(name) is not None}
+
+
+def get_baseline_cpu(names):
+    """get the CPU usage, from 0 to 1, of everything but the job pods on the given nodes, return ({node: CPU}, err)"""
+    try:
+        response = http.get(pod_cpu_api)
+        if response.status_code != 200:
+            return {}, f"Error: {response.status_code}"
+        res = response.json()
+        if not res["success"]:
+            return {}, f"Error: {res['msg']}"
+        return {name: res["nodes"][name]["other"] / 100 for name in names if name in res["nodes"]}, None
+    except Exception as e:
+        return {}, e
+
+
+def get_pod_num(name):
+    """get the current pod number of a node, counting the pods created here that it may not show yet
+
+    The number comes from a /cluster-state snapshot up to cluster_state_max_age old, or from the
+    last stream update, and the middleware counts a pod only once its watch saw it. The pods this
+    controller created after the number was taken, or pod_watch_lag seconds before, are added.
+    """
+    requested = time.monotonic()
+    _, pod_num, _, msg = get_metrics([name])
+    if name not in pod_num:
+        return None, msg
+    taken = requested
+    if use_stream and metrics_stream.updated_at is not None:
+        taken = min(taken, metrics_stream.updated_at)
+    elif use_cluster_state and cluster_state_time is not None:
+        taken = min(taken, cluster_state_time)
+    node = nodes.get(name)
+    unseen = node.pods_created_since(taken - pod_watch_lag) if node is not None else 0
+    return pod_num[name] + unseen, None
+
+
+# PID Controller Class
+
+
+class PIDController:
+    def __init__(self, kp, ki, kd):
+        self.kp = kp
+        self.ki = ki
+        self.kd = kd
+        self.prev_e = 0
+        self.integral = 0
+
+    def compute(self, actual_value, reference_input, dt=None):
+            # dt is the seconds since the previous sample, sample_rate if unknown
+            if dt is None:
+                dt = sample_rate
+            # Force more aggressive scaling when below target
+            if actual_value < 0.75:
+                err = 0.80 - actual_value
+            elif actual_value > 0.85:
+                err = 0.85 - actual_value
+            else:
+                err = reference_input - actual_value
+
+            # Reduced anti-windup threshold
+            if abs(self.integral) > 2.0:
+                self.integral = 0
+
+            self.integral += dt * err
+            derivative = (err - self.prev_e) / dt
+            u = self.kp * err + self.ki * self.integral + self.kd * derivative
+            self.prev_e = err
+            return max(1, min(round(u), max_pod_upperbound))
+
+
+class NodeController:
+    """closed loop state of one node: its PID controller, max_pod and recent samples"""
+
+    def __init__(self, name):
+        self.name = name
+        self.controller = PIDController(pid_kp, pid_ki, pid_kd)
+        self.reference_input = reference_input
+        self.max_pod = 1  # control input. Set by the closed loop, read by job assignment
+        self.running = False
+        self.last_pod_start_time = None
+        self.last_pod_finish_time = None
+        self.deleted_seq = 0  # latest reaped pod sequence number seen in /pod-num for this node
+        self.last_metrics_timestamp = None  # metrics-server timestamp of the last sample the closed loop ran on
+        self.cur_pod_id = 0
+        self.pod_id_lock = threading.Lock()  # cur_pod_id is taken by the endpoint threads and render_jobs
+        # held from the pod number check to the pod creation; with the pods counted by
+        # get_pod_num before the middleware shows them, concurrent job requests for the node
+        # can't together go over max_pod
+        self.admit_lock = threading.Lock()
+        self.created_times = deque()  # time.monotonic() of the pods created lately, see get_pod_num
+        self.pod_num = 0
+        self.job_list = deque()  # jobs read from job_file_name, not rendered yet
+        self.CPU_data = RingBuffer(history_size)
+        self.max_pod_data = RingBuffer(history_size)
+        # seconds until the CPU rises after a job started and falls after a job finished,
+        # measured at the sample rate
+        self.cpu_response = {"rise": Histogram(), "fall": Histogram()}
+        self.pending_response = {"rise": None, "fall": None}  # (job start/finish time, CPU before it)
+        self.seen_event = {"rise": None, "fall": None}  # last job start/finish time tracked
+        self.last_cpu = None
+        root, ext = os.path.splitext(record_file_name)
+        self.recorder = TimeSeriesRecorder(
+            f"{root}_{name}{ext}",
+            ["cpu", "max_pod", "pod_num", "err", "u"],
+            batch_size=record_batch_size,
+            max_bytes=record_max_bytes,
+            max_age=record_max_age,
+        )
+
+    def next_pod_names(self, n):
+        """reserve the names of the next n pods of this node"""
+        with self.pod_id_lock:
+            first = self.cur_pod_id
+            self.cur_pod_id += n
+        return [f"{self.name}-{pod_id}" for pod_id in range(first, first + n)]
+
+    def record_created(self, n):
+        """remember that n pods were just created, until any pod number fetched since includes them"""
+        now = time.monotonic()
+        with self.pod_id_lock:
+            self.created_times.extend([now] * n)
+            while self.created_times and now - self.created_times[0] > created_pods_memory:
+                self.created_times.popleft()
+
+    def pods_created_since(self, since):
+        """number of pods created at or after since, a time.monotonic()"""
+        with self.pod_id_lock:
+            return sum(1 for created in self.created_times if created >= since)
+
+    def run_job(self, job):
+        """create a new pod on this node running the job"""
+        try:
+            payload = {"job": job.to_dict(), "name": self.next_pod_names(1)[0], "node": self.name}
+            response = http.post(create_pod_api, json=payload)
+            if response.status_code == 200:
+                res = response.json()
+                if res["success"]:
+                    self.record_created(1)
+                return res["success"], res["msg"]
+            else:
+                return False, f"Error: {response.status_code}"
+        except Exception as e:
+            return None, e
+
+    def run_jobs(self, jobs):
+        """create the pods of the jobs on this node with one request, return [(ok, msg)] per job"""
+        pods = [
+            {"job": job.to_dict(), "name": pod_name, "node": self.name}
+            for job, pod_name in zip(jobs, self.next_pod_names(len(jobs)))
+        ]
+        try:
+            response = http.post(create_pods_api, json={"pods": pods})
+            if response.status_code == 200:
+                res = response.json()
+                if len(res.get("results", [])) != len(jobs):
+                    # results can't be matched to the jobs, they all go back to be run again
+                    return [(False, f"Error: {len(res.get('results', []))} results for {len(jobs)} jobs: {res.get('msg', '')}")] * len(jobs)
+                self.record_created(sum(1 for result in res["results"] if result["success"]))
+                return [(result["success"], result["msg"]) for result in res["results"]]
+            else:
+                return [(False, f"Error: {response.status_code}")] * len(jobs)
+        except Exception as e:
+            return [(False, e)] * len(jobs)
+
+    def stop(self):
+        """stop the closed loop, the first sample after a restart starts a new dt baseline"""
+        self.running = False
+        # otherwise the first step after a restart would integrate the whole stop, up to max_pid_dt
+        self.last_metrics_timestamp = None
+
+    def track_cpu_response(self, cur_cpu, now):
+        """time the first CPU change after the last job started or finished"""
+        events = {"rise": self.last_pod_start_time, "fall": self.last_pod_finish_time}
+        for direction, event_time in events.items():
+            pending = self.pending_response[direction]
+            if event_time != self.seen_event[direction]:
+                self.seen_event[direction] = event_time
+                saturated = direction == "rise" and self.last_cpu is not None and self.last_cpu > 1 - cpu_response_threshold
+                if pending is None and self.last_cpu is not None and not saturated:
+                    # jobs started (or finished) while a response is pending are timed with the
+                    # first one, an overestimate that errs on the side of waiting
+                    pending = (event_time, self.last_cpu)
+                    self.pending_response[direction] = pending
+            if pending is None:
+                continue
+            elapsed = (now - pending[0]).total_seconds()
+            change = cur_cpu - pending[1] if direction == "rise" else pending[1] - cur_cpu
+            if change >= cpu_response_threshold:
+                self.cpu_response[direction].observe(elapsed)
+                self.pending_response[direction] = None
+            elif elapsed > cpu_response_timeout:
+                # the CPU didn't respond, e.g. the job is idle or another one finished at the same time
+                self.pending_response[direction] = None
+
+    def job_delay_for(self, direction):
+        """seconds to wait after a job started ("rise") or finished ("fall") before running the closed loop"""
+        histogram = self.cpu_response[direction]
+        if not adaptive_job_delay or histogram.count < job_delay_min_samples:
+            return job_delay
+        return max(job_delay_min, min(histogram.quantile(job_delay_quantile), job_delay_max))
+
+    def closed_loop_step(self, cur_cpu, pod_num, now=None, metrics_timestamp=None):
+        """run one closed loop iteration on a CPU and pod number sample, and update max_pod
+
+        Returns (e, u), both None when the iteration is skipped because the system is not stable
+        yet or the CPU is not a newer metrics-server sample than last time (metrics_timestamp, in
+        seconds, not after the previous one). now defaults to datetime.now(), the simulator passes its own clock.
+        """
+        if now is None:
+            now = datetime.now()
+        dt = None
+        if skip_stale_samples and metrics_timestamp is not None:
+            if self.last_metrics_timestamp is not None and metrics_timestamp <= self.last_metrics_timestamp:
+                # a repeat, or an older sample (e.g. from another metrics-server replica), dt must stay positive
+                logging.info(f"{self.name}: no new metrics since {self.last_metrics_timestamp}, skipping closed loop")
+                return None, None
+            if self.last_metrics_timestamp is not None:
+                dt = min(metrics_timestamp - self.last_metrics_timestamp, max_pid_dt)
+            self.last_metrics_timestamp = metrics_timestamp
+        self.track_cpu_response(cur_cpu, now)
+        self.last_cpu = cur_cpu
+        e = u = None
+        time_since_last_job_created = (
+            (now - self.last_pod_start_time).total_seconds()
+            if self.last_pod_start_time is not None
+            else float("inf")
+        )
+        time_since_last_job_deleted = (
+            (now - self.last_pod_finish_time).total_seconds()
+            if self.last_pod_finish_time is not None
+            else float("inf")
+        )
+        if (pod_num > self.max_pod and cur_cpu > self.reference_input) or (
+            pod_num < self.max_pod and cur_cpu < self.reference_input
+        ):
+            # pod_num hasn't achieve the max_pod with the right dirrection(pod could increase while CPU needs to increase), so wait until the changes actually happens
+            logging.info(
+                f"{self.name}: max_pod {self.max_pod} != pod_num {pod_num}, skipping closed loop"
+            )
+        elif time_since_last_job_created < self.job_delay_for("rise") and cur_cpu < self.reference_input:
+            # pod just created, so it has the potenrial to increase the cpu to the reference input, wait for a while to let the stress tests started
+            logging.info(
+                f"{self.name}: last job started {time_since_last_job_created}s ago, skipping closed loop, max_pod {self.max_pod}"
+            )
+        elif time_since_last_job_deleted < self.job_delay_for("fall") and cur_cpu > self.reference_input:
+            logging.info(
+                f"{self.name}: last job finished {time_since_last_job_deleted}s ago, skipping closed loop, max_pod {self.max_pod}"
+            )
+        else:
+            # compute the close loop and undate the max_pod only if the maxpod == pod_num, otherwise, the system is not stable yet
+            e = self.reference_input - cur_cpu
+            u = self.controller.compute(e, self.reference_input, dt)
+            logging.info(f"{self.name}: closed loop: e: {e}, u: {u}")
+            new_max_pod = round(u)
+            if new_max_pod < 1:
+                new_max_pod = 1
+            if new_max_pod >= max_pod_upperbound:
+                new_max_pod = max_pod_upperbound
+                logging.info(f"{self.name}: maxpod hitting upper bound {max_pod_upperbound}")
+            if new_max_pod > self.max_pod:
+                logging.info(f"{self.name}: scaling up, max_pod {self.max_pod} -> {new_max_pod}")
+            elif new_max_pod < self.max_pod:
+                logging.info(f"{self.name}: scaling down, max_pod {self.max_pod} -> {new_max_pod}")
+            else:
+                logging.info(f"{self.name}: max_pod remains {self.max_pod}")
+            self.max_pod = new_max_pod
+        return e, u
+
+    def sample(self, cur_cpu, pod_num, metrics_timestamp=None):
+        """run the closed loop on one sample, None values fall back to the previous sample"""
+        if cur_cpu is None:
+            if len(self.CPU_data) != 0:
+                logging.critical(f"{self.name}: no CPU, using last CPU {self.CPU_data[-1]}")
+                cur_cpu = self.CPU_data[-1]
+            else:
+                logging.critical(f"{self.name}: no CPU, set CPU to be 0")
+                cur_cpu = 0
+        if pod_num is None:
+            logging.critical(f"{self.name}: no pod number, using previous pod number, {self.pod_num}")
+            pod_num = self.pod_num
+        logging.info(f"{self.name}: current CPU: {cur_cpu}")
+        self.CPU_data.append(cur_cpu)
+        self.pod_num = pod_num
+
+        e, u = self.closed_loop_step(cur_cpu, pod_num, metrics_timestamp=metrics_timestamp)
+        self.max_pod_data.append(self.max_pod)
+        self.recorder.record(cur_cpu, self.max_pod, pod_num, e, u)
+
+
+def get_node(name, create=False):
+    """return the controller of a node, and an error message if it isn't controlled here"""
+    with nodes_lock:
+        if name not in nodes:
+            if not create:
+                return None, f"node {name} is not controlled by this local controller"
+            logging.info(f"adding node {name}")
+            nodes[name] = NodeController(name)
+        return nodes[name], None
+
+
+# Monitoring and Job Handling
+def wait_for_next_sample():
+    """sleep sample_rate seconds, or less if subscribed to the stream and a node CPU changed"""
+    if use_stream:
+        cpu_updated.wait(timeout=sample_rate)
+        cpu_updated.clear()
+    else:
+        time.sleep(sample_rate)
+
+
+def closed_loop():
+    """run the closed loop of every started node, on one metrics fetch per sample"""
+    logging.info("start close loop")
+    while True:
+        running = [node for node in list(nodes.values()) if node.running]
+        if not running:
+            # no controller started, sleep and continue
+            logging.info("controllers stopped, waiting")
+            time.sleep(sample_rate)
+            continue
+
+        cpu, pod_num, timestamps, msg = get_metrics([node.name for node in running])
+        if msg is not None:
+            logging.critical(f"error getting the CPU and pod numbers: {msg}")
+        if subtract_baseline_cpu and cpu:
+            baseline, msg = get_baseline_cpu(list(cpu))
+            if msg is not None:
+                # the node CPU is used as is, the baseline is only known while /pod-cpu answers
+                logging.error(f"error getting the baseline CPU: {msg}")
+            for name, other in baseline.items():
+                logging.info(f"{name}: baseline CPU {other}")
+                cpu[name] = max(0.0, cpu[name] - other)
+        for node in running:
+            node.sample(cpu.get(node.name), pod_num.get(node.name), timestamps.get(node.name))
+        wait_for_next_sample()
+
+
+def render_jobs(node):
+    while node.job_list:
+        with node.admit_lock:
+            render_job_batch(node)
+        time.sleep(job_sleep_time)
+    logging.info("job finished")
+
+
+def render_job_batch(node):
+    """send as many jobs of the node job list as its max_pod has room for"""
+    # check if cur_pod_num < max_pod
+    cur_pod_num, msg = get_pod_num(node.name)
+    if msg != None:
+        logging.critical(f"get job num error: {msg}")
+        logging.critical("abondon job rendering, will try to render this job later")
+    elif cur_pod_num >= node.max_pod:
+        logging.info(
+            f"current pod num: {cur_pod_num}, max pod num: {node.max_pod}, job not scheduled"
+        )
+    else:
+        # every job there is room for is sent as one batch
+        batch_size = min(node.max_pod - cur_pod_num, len(node.job_list))
+        batch = [node.job_list.popleft() for _ in range(batch_size)]
+        logging.info(
+            f"current pod num: {cur_pod_num}, scheduling {batch_size} jobs on {node.name}"
+        )
+        failed = []
+        for job, (ok, msg) in zip(batch, node.run_jobs(batch)):
+            if not ok:
+                logging.error(
+                    f"error when trying to run job {job}: {msg}, will try to run this job again"
+                )
+                failed.append(job)
+        node.job_list.extendleft(reversed(failed))
+        if len(failed) < batch_size:
+            node.last_pod_start_time = datetime.now()
+        logging.info(
+            f"{batch_size - len(failed)} jobs scheduled, remaining jobs: {len(node.job_list)}"
+        )
+
+
+def save_cpu_max_pod():
+    """periodically append the buffered samples of every node to its record file"""
+    while True:
+        for node in list(nodes.values()):
+            if len(node.CPU_data) > 0:
+                logging.info(f"{node.name}: saving CPU {node.CPU_data[-1]} and max_pod {node.max_pod_data[-1]}")
+            node.recorder.flush()
+        time.sleep(record_flush_time)
+
+
+@app.on_event("shutdown")
+def flush_records():
+    """append the rows buffered since the last save_cpu_max_pod, they would be lost on exit"""
+    for node in list(nodes.values()):
+        node.recorder.flush()
+
+
+# Endpoints
+@app.get("/start")
+async def start_controllers():
+    """Start the controller of every node."""
+    for node in list(nodes.values()):
+        node.running = True
+    return {"success": True, "msg": ""}
+
+
+@app.get("/stop")
+async def stop_controllers():
+    """Stop the controller of every node."""
+    for node in list(nodes.values()):
+        node.stop()
+    return {"success": True, "msg": ""}
+
+
+@app.get("/nodes")
+async def list_nodes():
+    """Return the nodes controlled here, with their maxpod and whether their controller runs."""
+    return {
+        "success": True,
+        "msg": "",
+        "nodes": {
+            node.name: {"running": node.running, "maxpod": node.max_pod}
+            for node in list(nodes.values())
+        },
+    }
+
+
+@app.get("/nodes/{name}/start")
+async def start_controller(name: str):
+    """Start the controller of a node, adding the node if it isn't controlled yet."""
+    try:
+        node, _ = get_node(name, create=True)
+        node.running = True
+        return {"success": True, "msg": ""}
+    except Exception as e:
+        logging.error(f"Error starting the local controller of {name}: {e}")
+        return {"success": False, "msg": str(e)}
+
+
+@app.get("/nodes/{name}/stop")
+async def stop_controller(name: str):
+    """Stop the controller of a node."""
+    node, msg = get_node(name)
+    if node is None:
+        return {"success": False, "msg": msg}
+    node.stop()
+    return {"success": True, "msg": ""}
+
+
+@app.get("/nodes/{name}/pod-num")
+def get_node_pod_num(name: str):
+    """Return the current pod number of a node."""
+    try:
+        node, msg = get_node(name)
+        if node is None:
+            return {"success": False, "msg": msg, "pod-num": 0}
+        res, msg = get_pod_num(name)
+        if res is None:
+            return {"success": False, "msg": str(msg), "pod-num": 0}
+        else:
+            return {"success": True, "msg": "", "pod-num": res}
+    except Exception as e:
+        logging.error(f"Error in get_node_pod_num: {e}")
+        return {"success": False, "msg": str(e), "pod-num": 0}
+
+
+@app.get("/nodes/{name}/maxpod")
+async def get_maxpod(name: str):
+    """Return the current maxpod number of a node."""
+    node, msg = get_node(name)
+    if node is None:
+        return {"success": False, "msg": msg, "maxpod": 0}
+    return {"success": True, "msg": "", "maxpod": node.max_pod}
+
+
+@app.get("/nodes/{name}/cpu-response")
+async def get_cpu_response(name: str):
+    """Return the CPU response times of a node to jobs started and finished, and the job delays used."""
+    node, msg = get_node(name)
+    if node is None:
+        return {"success": False, "msg": msg}
+    return {
+        "success": True,
+        "msg": "",
+        "cpu_response": {direction: histogram.snapshot() for direction, histogram in node.cpu_response.items()},
+        "job_delay": {direction: node.job_delay_for(direction) for direction in node.cpu_response},
+    }
+
+
+@app.get("/latency")
+async def get_latency():
+    """Return the latency of each middleware endpoint called by this controller."""
+    return {"success": True, "msg": "", "latency": http.latency_stats()}
+
+
+@app.post("/nodes/{name}/job")
+async def handle_post(name: str, request: Request):
+    """Add a new job to a node."""
+    try:
+        node, msg = get_node(name)
+        if node is None:
+            return {"success": False, "msg": msg}
+
+        # Parse JSON payload
+        data = await request.json()
+        job, msg = job_from_payload(data.get("job"))
+        if job is None:
+            logging.error(f"Received an invalid job request for {name}: {msg}")
+            return {"success": False, "msg": msg}
+
+        logging.info(f"Received a new job request for {name}: {job}")
+        # the middleware calls block, they run in the threadpool so the other nodes' routes keep answering
+        return await run_in_threadpool(admit_job, node, job)
+    except Exception as e:
+        logging.error(f"An error occurred in handle_post: {e}")
+        return {"success": False, "msg": str(e)}
+
+
+def admit_job(node, job):
+    """create the pod of a job if the node's maxpod has room for it, return the /job response"""
+    with node.admit_lock:
+        cur_pod_num, msg = get_pod_num(node.name)
+        if cur_pod_num is None:
+            return {"success": False, "msg": f"Unable to get the pod number. Error: {msg}"}
+        if cur_pod_num >= node.max_pod:
+            logging.info(f"Maximum pod limit reached on {node.name}: current pods ({cur_pod_num}) >= max pods ({node.max_pod}). Unable to assign a new job.")
+            return {
+                "success": False,
+                "msg": f"Current pods ({cur_pod_num}) >= max pods ({node.max_pod}). Unable to assign a new job.",
+            }
+
+        # Render the job
+        logging.info(f"Current pod count on {node.name}: {cur_pod_num}. Scheduling job: {job}")
+        ok, msg = node.run_job(job)
+        if not ok:
+            logging.error(f"Failed to schedule the job. Error: {msg}")
+            return {"success": False, "msg": f"Failed to start new job. Error: {msg}"}
+
+        node.last_pod_start_time = datetime.now()
+    logging.info("Job successfully scheduled.")
+    return {"success": True, "msg": ""}
+
+
+@app.post("/nodes/{name}/jobs")
+async def handle_post_batch(name: str, request: Request):
+    """Add a batch of jobs to a node, {"jobs": [...]}, as many as its maxpod has room for.
+
+    The admitted jobs are created with one /pods request. Returns one {"success", "msg"}
+    result per job, in request order.
+    """
+    try:
+        node, msg = get_node(name)
+        if node is None:
+            return {"success": False, "msg": msg, "results": []}
+
+        data = await request.json()
+        payloads = data.get("jobs", [])
+        logging.info(f"Received {len(payloads)} job requests for {name}")
+        return await run_in_threadpool(admit_jobs, node, payloads)
+    except Exception as e:
+        logging.error(f"An error occurred in handle_post_batch: {e}")
+        return {"success": False, "msg": str(e), "results": []}
+
+
+def admit_jobs(node, payloads):
+    """create the pods of as many jobs as the node's maxpod has room for, return the /jobs response"""
+    with node.admit_lock:
+        cur_pod_num, msg = get_pod_num(node.name)
+        if cur_pod_num is None:
+            return {"success": False, "msg": f"Unable to get the pod number. Error: {msg}", "results": []}
+
+        results = [None] * len(payloads)
+        admitted = []  # (index in the request, job)
+        for index, value in enumerate(payloads):
+            job, msg = job_from_payload(value)
+            if job is None:
+                results[index] = {"success": False, "msg": msg}
+            elif cur_pod_num + len(admitted) >= node.max_pod:
+                results[index] = {
+                    "success": False,
+                    "msg": f"Current pods ({cur_pod_num + len(admitted)}) >= max pods ({node.max_pod}). Unable to assign a new job.",
+                }
+            else:
+                admitted.append((index, job))
+
+        if admitted:
+            logging.info(f"Current pod count on {node.name}: {cur_pod_num}. Scheduling {len(admitted)} jobs.")
+            created = node.run_jobs([job for _, job in admitted])
+            for (index, job), (ok, msg) in zip(admitted, created):
+                if not ok:
+                    logging.error(f"Failed to schedule job {job}. Error: {msg}")
+                results[index] = {"success": bool(ok), "msg": "" if ok else f"Failed to start new job. Error: {msg}"}
+            if any(ok for ok, _ in created):
+                node.last_pod_start_time = datetime.now()
+    return {"success": all(result["success"] for result in results), "msg": "", "results": results}
+
+
+@app.post("/nodes/{name}/reference-input")
+async def handle_post_json(name: str, request: Request):
+    """Set the reference input of a node, as a CPU percentage."""
+    try:
+        node, msg = get_node(name)
+        if node is None:
+            return {"success": False, "msg": msg}
+        data = await request.json()
+        value = int(data.get("value"))
+        if 0 <= value <= 100:
+            logging.info(f"Reference input of {name} updated to: {value}%")
+            node.reference_input = value / 100
+            return {"success": True, "msg": ""}
+        else:
+            logging.warning(f"Invalid reference input: {value}. It must be between 0 and 100.")
+            return {"success": False, "msg": "Reference input must be between 0 and 100."}
+    except Exception as e:
+        logging.error(f"An error occurred while setting the reference input: {e}")
+        return {"success": False, "msg": str(e)}
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.DEBUG,
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    )
+
+    # Set the logging level for 'urllib3.connectionpool' to WARNING or higher
+    logging.getLogger("urllib3.connectionpool").setLevel(logging.WARNING)
+
+    # Log the configurations
+    logging.debug(f"Controlled Nodes: {node_names}")
+    logging.debug(f"Configured Sample Rate: {sample_rate} seconds")
+    logging.debug(f"Initial Reference Input (CPU Usage Target): {reference_input * 100}%")
+    logging.debug(f"Job Sleep Time: {job_sleep_time} seconds")
+    logging.debug(f"Job File Name: {job_file_name}")
+    logging.debug(f"CPU API Endpoint: {cpu_api}")
+    logging.debug(f"Pod Number API Endpoint: {pod_num_api}")
+    logging.debug(f"Pod Creation API Endpoint: {create_pod_api}")
+
+    for name in node_names:
+        get_node(name, create=True)
+
+    if use_stream:
+        logging.info(f"Subscribing to the metrics stream: {stream_api}")
+        metrics_stream.start()
+
+    # Start a thread running the closed loop of every node
+    closed_loop_thread = threading.Thread(target=closed_loop)
+    closed_loop_thread.daemon = True
+    closed_loop_thread.start()
+
+    # Load job list and start job rendering, if required
+    if read_jobs_flag:
+        node, _ = get_node(job_node, create=True)
+        lines, error = read_file_to_list(job_file_name)
+        logging.info(f"Attempting to load job list from file: {job_file_name}")
+        if error:
+            logging.critical(f"Failed to retrieve job list: {error}")
+            logging.critical("Application shutting down due to job list error.")
+            exit(0)
+        for line in lines:
+            if not line or line.startswith("#"):
+                continue
+            job, error = parse_job(line)
+            if error:
+                logging.error(f"Skipping job: {error}")
+            else:
+                node.job_list.append(job)
+
+        # Allow the closed-loop controller to stabilize before job rendering
+        time.sleep(5)
+        logging.info(f"Successfully loaded job list. Starting job rendering on {job_node}...")
+        job_render_thread = threading.Thread(target=render_jobs, args=(node,))
+        job_render_thread.daemon = True
+        job_render_thread.start()
+    else:
+        logging.info("Job list is empty. No jobs to render.")
+
+    # Start thread to save CPU and max pod data periodically
+    save_res_thread = threading.Thread(target=save_cpu_max_pod)
+    save_res_thread.daemon = True
+    save_res_thread.start()
+
+    # Start the FastAPI server
+    logging.info("Starting server on host 0.0.0.0, port 5004...")
+    import uvicorn
+    uvicorn.run(app, host="0.0.0.0", port=5004)
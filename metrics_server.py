@@ -1,54 +1,211 @@
-import subprocess
+from fastapi import FastAPI
+from kubernetes import client, config
+import logging
+import sqlite3
+import threading
 import time
-import json
 
+from quantity import parse_cpu, parse_memory
+
+# settings
+sampling_rate = 1  # sample the CPU and memory usage of every node every X seconds
+capacity_refresh_time = 300  # re-list the node capacities every X seconds, nodes seen in between are read on their first sample
+store_file = "metrics.db"  # SQLite file of the samples, ":memory:" keeps them in memory only
+retention_time = 3600  # keep the samples of the last X seconds, older ones are deleted as new ones are written
+max_query_points = 2000  # upper bound of the points returned per node by /samples, the step is raised to fit
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
+# Loading Kube config
+config.load_kube_config()
+
+# One ApiClient shared by the sampler and the capacity reads
+api_client = client.ApiClient()
+core_api = client.CoreV1Api(api_client)
+custom_api = client.CustomObjectsApi(api_client)
+
+app = FastAPI()
+
+node_capacity = {}  # node name -> (CPU capacity in nanocores, memory capacity in bytes)
+capacity_time = 0  # time.monotonic() of the last node list
+
+
+class SampleStore:
+    """Ring store of per-node CPU and memory samples in SQLite.
+
+    Samples older than retention seconds are deleted as new ones are written, so the store
+    keeps a fixed window whatever the uptime. range() averages the samples of each step
+    seconds in SQL, so a query costs one indexed scan of the window it asks for.
+    """
+
+    def __init__(self, file_name, retention):
+        self.retention = retention
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(file_name, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS samples (node TEXT NOT NULL, time REAL NOT NULL, cpu REAL, memory REAL)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS samples_node_time ON samples (node, time)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS samples_time ON samples (time)")
+        self.db.commit()
+
+    def add(self, timestamp, usage):
+        """Write one sample, {node: (cpu percent, memory percent)}, and drop the expired ones."""
+        with self.lock:
+            self.db.executemany(
+                "INSERT INTO samples VALUES (?, ?, ?, ?)",
+                [(node_name, timestamp, cpu, memory) for node_name, (cpu, memory) in usage.items()],
+            )
+            self.db.execute("DELETE FROM samples WHERE time < ?", (timestamp - self.retention,))
+            self.db.commit()
+
+    def nodes(self):
+        with self.lock:
+            return [row[0] for row in self.db.execute("SELECT DISTINCT node FROM samples ORDER BY node")]
+
+    def latest(self):
+        """Return {node: {"time", "cpu", "memory"}} of the newest sample of every node."""
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT node, MAX(time), cpu, memory FROM samples GROUP BY node ORDER BY node"
+            ).fetchall()
+        return {node_name: {"time": t, "cpu": cpu, "memory": memory} for node_name, t, cpu, memory in rows}
+
+    def range(self, node_name, start, step):
+        """
+        Return the samples of a node since start, averaged over buckets of step seconds
+        (raw samples if step is 0): [{"time", "cpu", "cpu_max", "memory", "memory_max", "count"}].
+        """
+        with self.lock:
+            if step <= 0:
+                rows = self.db.execute(
+                    "SELECT time, cpu, cpu, memory, memory, 1 FROM samples WHERE node = ? AND time >= ? ORDER BY time",
+                    (node_name, start),
+                ).fetchall()
+            else:
+                rows = self.db.execute(
+                    "SELECT ? + CAST((time - ?) / ? AS INTEGER) * ?, AVG(cpu), MAX(cpu), AVG(memory), MAX(memory), COUNT(*)"
+                    " FROM samples WHERE node = ? AND time >= ? GROUP BY CAST((time - ?) / ? AS INTEGER) ORDER BY 1",
+                    (start, start, step, step, node_name, start, start, step),
+                ).fetchall()
+        return [
+            {"time": t, "cpu": cpu, "cpu_max": cpu_max, "memory": memory, "memory_max": memory_max, "count": count}
+            for t, cpu, cpu_max, memory, memory_max, count in rows
+        ]
+
+
+store = SampleStore(store_file, retention_time)
+
+
+def set_node_capacity(node):
+    capacity = node.status.capacity if node.status is not None else None
+    if not capacity or "cpu" not in capacity or "memory" not in capacity:
+        logging.warning(f"Node {node.metadata.name} reports no capacity yet")
+        return None
+    node_capacity[node.metadata.name] = (parse_cpu(capacity["cpu"]), parse_memory(capacity["memory"]))
+    return node_capacity[node.metadata.name]
+
+
+def load_node_capacity():
+    """Refresh the capacity of every node from a single node list."""
+    global capacity_time
+    nodes_all = core_api.list_node()
+    node_capacity.clear()
+    for node in nodes_all.items:
+        set_node_capacity(node)
+    capacity_time = time.monotonic()
 
-sampling_rate = 1
 
 def get_node_capacity(node_name):
-    # Command to get node capacity
-    command = ['kubectl', 'get', 'node', node_name, '-o', 'json']
-    result = subprocess.run(command, capture_output=True, text=True)
-
-    if result.returncode == 0:
-        node_info = json.loads(result.stdout)
-        cpu_capacity_str = node_info['status']['capacity']['cpu']
-        if cpu_capacity_str.endswith("m"):
-            cpu_capacity_nanocores = int(cpu_capacity_str[:-1]) * 1e6
-        else:
-            cpu_capacity_nanocores = int(cpu_capacity_str) * 1e9
-        return cpu_capacity_nanocores
-    else:
-        print(f"Error getting node capacity: {result.stderr}")
+    if node_name in node_capacity:
+        return node_capacity[node_name]
+    try:
+        return set_node_capacity(core_api.read_node(node_name))
+    except client.ApiException as e:
+        logging.error(f"Failed to retrieve node capacity for {node_name}: {e}")
         return None
 
+
 def get_metrics():
-    command = ['kubectl', 'get', '--raw', '/apis/metrics.k8s.io/v1beta1/nodes']
-    
-    result = subprocess.run(command, capture_output=True, text=True)
-    
-    if result.returncode == 0:
-        metrics = json.loads(result.stdout)
-
-        for node in metrics.get('items', []):
-            node_name = node['metadata']['name']
-            cpu_usage_str = node['usage']['cpu']
-            
-            if cpu_usage_str.endswith("n"):
-                cpu_usage_nanocores = int(cpu_usage_str.rstrip('n'))
-            else:
-                cpu_usage_nanocores = int(cpu_usage_str.rstrip('m')) * 1e6
+    """Return {node: (cpu percent, memory percent)} from one metrics.k8s.io list."""
+    if time.monotonic() - capacity_time > capacity_refresh_time:
+        load_node_capacity()
+    usage = {}
+    metrics = custom_api.list_cluster_custom_object("metrics.k8s.io", "v1beta1", "nodes")
+    for node in metrics.get("items", []):
+        node_name = node["metadata"]["name"]
+        try:
+            cpu_usage_nanocores = parse_cpu(node["usage"]["cpu"])
+            memory_usage_bytes = parse_memory(node["usage"]["memory"])
+        except (KeyError, ValueError) as e:
+            logging.error(f"Invalid usage for node {node_name}: {e}")
+            continue
+        capacity = get_node_capacity(node_name)
+        if capacity:
+            cpu_capacity_nanocores, memory_capacity_bytes = capacity
+            usage[node_name] = (
+                (cpu_usage_nanocores / cpu_capacity_nanocores) * 100,
+                (memory_usage_bytes / memory_capacity_bytes) * 100,
+            )
+        else:
+            logging.warning(f"Could not calculate the usage of node {node_name}")
+    return usage
 
-            cpu_capacity_nanocores = get_node_capacity(node_name)
 
-            if cpu_capacity_nanocores:
-                cpu_usage_percentage = (cpu_usage_nanocores / cpu_capacity_nanocores) * 100
-                print(f"Node : {node_name}, cpu: {cpu_usage_percentage:.2f}")
-            else:
-                print(f"Could not calculate CPU usage for node: {node_name}")
-    else:
-        print(f"Error getting metrics: {result.stderr}")
+def sample_metrics():
+    """Sample every sampling_rate seconds, on a fixed schedule that doesn't drift with the call time."""
+    next_sample = time.monotonic()
+    while True:
+        try:
+            store.add(time.time(), get_metrics())
+        except Exception as e:
+            logging.error(f"Error sampling the node metrics: {e}")
+        next_sample += sampling_rate
+        delay = next_sample - time.monotonic()
+        if delay < 0:
+            # the sample took longer than sampling_rate, skip the missed ones
+            next_sample = time.monotonic()
+            delay = 0
+        time.sleep(delay)
+
+
+@app.on_event("startup")
+def start_sampler():
+    sampler_thread = threading.Thread(target=sample_metrics)
+    sampler_thread.daemon = True
+    sampler_thread.start()
+
+
+@app.get("/latest")
+def get_latest():
+    """Return the newest CPU and memory usage (percent) of every node."""
+    return {"success": True, "msg": "", "nodes": store.latest()}
+
+
+@app.get("/samples")
+def get_samples(seconds: float = 300, step: float = 0, node: str = None):
+    """
+    Return the CPU and memory usage (percent) of the last `seconds` seconds, of one node or of
+    all of them, averaged over buckets of `step` seconds (raw samples if 0).
+    """
+    if seconds <= 0 or step < 0:
+        return {"success": False, "msg": "seconds must be positive and step not negative", "nodes": {}}
+    if seconds / max(step, sampling_rate) > max_query_points:
+        # bound the response size, a long window is downsampled to max_query_points
+        step = seconds / max_query_points
+    start = time.time() - seconds
+    node_list = [node] if node is not None else store.nodes()
+    return {
+        "success": True,
+        "msg": "",
+        "step": step,
+        "nodes": {node_name: store.range(node_name, start, step) for node_name in node_list},
+    }
+
+
+if __name__ == "__main__":
+    import uvicorn
 
-while True:
-    get_metrics()
-    time.sleep(sampling_rate)
+    uvicorn.run(app, host="0.0.0.0", port=5002)
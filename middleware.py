@@ -1,11 +1,19 @@
 from fastapi import FastAPI, HTTPException, Request
-from fastapi.responses import JSONResponse
-from kubernetes import client, config
-import re
-import subprocess
+from fastapi.responses import JSONResponse, StreamingResponse
+from kubernetes import client, config, watch
+import asyncio
+import functools
 import json
 import logging
+import re
 import datetime
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from histogram import Histogram
+from jobs import Job, job_from_payload
+from quantity import parse_cpu, parse_memory
 
 # Loading Kube config
 config.load_kube_config()
@@ -15,104 +23,883 @@ app = FastAPI()
 
 logging.basicConfig(level=logging.DEBUG, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
 
-
-def get_node_capacity(node_name: str):
-    command = ["kubectl", "get", "node", node_name, "-o", "json"]
-    result = subprocess.run(command, capture_output=True, text=True)
-    if result.returncode == 0:
-        node_info = json.loads(result.stdout)
-        cpu_capacity_cores = int(node_info["status"]["capacity"]["cpu"])
-        logging.info(f"CPU capacity for node {node_name} : {cpu_capacity_cores}")
-        return cpu_capacity_cores * 1e9
+# settings
+node_watch_timeout = 300  # every X seconds, the node watch is restarted with a full re-list
+watch_retry_delay = 5  # wait X seconds before re-listing after a failed watch
+pod_resync_interval = 60  # every X seconds, the pod watch is restarted with a full re-list
+reap_interval = 1  # every X seconds, delete the completed pods found in the pod index
+reap_workers = 8  # number of completed pod deletions running at the same time
+deleted_pods_history = 100  # number of recently deleted pod names remembered per node
+k8s_workers = 16  # number of blocking Kubernetes calls the endpoints can run at the same time
+stream_interval = 1  # every X seconds, /stream subscribers get the changes since the last check
+stream_keepalive = 15  # send a comment line to idle /stream subscribers every X seconds
+stream_queue_size = 16  # events buffered per /stream subscriber before it is dropped
+pod_create_parallelism = 8  # pods of one /pods request created at the same time
+stress_image = "polinux/stress-ng:latest"  # pin a digest, e.g. "polinux/stress-ng@sha256:<digest>", so IfNotPresent can't run a stale tag
+stress_image_pull_policy = "IfNotPresent"  # the image is only pulled if the node doesn't have it yet
+stress_resources = None  # resources of every stress-ng container, e.g. {"requests": {"cpu": "1"}, "limits": {"cpu": "2"}}
+prepull_image = False  # at startup, create a DaemonSet that pulls stress_image on every node
+prepull_daemonset_name = "stress-ng-prepull"
+prepull_namespace = "kube-system"  # outside "default", so its pods are not counted or evicted as jobs
+prepull_pause_image = "registry.k8s.io/pause:3.9"  # keeps the pre-pull pods running at no cost
+pod_timings_limit = 1000  # number of created pods whose lifecycle timestamps are tracked until they are reaped
+metrics_ttl = 5  # seconds a metrics.k8s.io node or pod list is reused, metrics-server itself refreshes about every 15s
+
+# One ApiClient shared by every Kubernetes call, its pool covers the endpoint workers,
+# the reaper workers and the two long-lived watches
+k8s_configuration = client.Configuration.get_default_copy()
+k8s_configuration.connection_pool_maxsize = k8s_workers + reap_workers + 2
+api_client = client.ApiClient(k8s_configuration)
+core_api = client.CoreV1Api(api_client)
+custom_api = client.CustomObjectsApi(api_client)
+apps_api = client.AppsV1Api(api_client)
+k8s_executor = ThreadPoolExecutor(max_workers=k8s_workers)
+
+# node name -> CPU capacity in nanocores, filled once and kept current by watch_nodes
+node_capacity = {}
+node_memory_capacity = {}  # node name -> memory capacity in bytes, kept with node_capacity
+node_names = set()  # every node seen by watch_nodes, including those without a capacity yet
+node_capacity_lock = threading.Lock()
+
+# "nodes" or "pods" -> (time.monotonic() of the fetch, metrics.k8s.io list, {name: (timestamp, window)})
+metrics_cache = {}
+metrics_inflight = {}  # "nodes" or "pods" -> Future of the fetch in progress, shared by concurrent callers
+metrics_cache_stats = {kind: {"fetches": 0, "hits": 0, "coalesced": 0} for kind in ["nodes", "pods"]}
+metrics_cache_lock = threading.Lock()
+go_duration_pattern = re.compile(r"(\d+(?:\.\d+)?)(h|ms|us|µs|ns|m|s)")
+go_duration_units = {"h": 3600, "m": 60, "s": 1, "ms": 1e-3, "us": 1e-6, "µs": 1e-6, "ns": 1e-9}
+
+# node name -> {pod name: phase} for the "default" namespace, kept current by watch_pods
+pod_index = {}
+pod_index_lock = threading.Lock()
+
+# node name -> ring buffer of (sequence number, pod name) for the pods reaped on that node
+deleted_pods = {}
+deleted_seq = 0  # sequence number of the most recent reaped pod
+reported_seq = {}  # node name -> deleted_seq already returned by /pod-num for that node
+deleted_pods_lock = threading.Lock()
+reap_lock = threading.Lock()
+reap_executor = ThreadPoolExecutor(max_workers=reap_workers)
+
+# pod name -> {"node", "created", "scheduled", "running", "completed"} epoch seconds of the pods
+# created by start_new_pod, until they are reaped
+pod_timings = {}
+# node name -> {interval: Histogram} of the seconds between two lifecycle steps of its pods
+pod_latency = {}
+pod_timings_lock = threading.Lock()
+# interval -> (from step, to step)
+pod_latency_intervals = {
+    "schedule": ("created", "scheduled"),  # create request to the pod bound to its node
+    "start": ("created", "running"),  # create request to the container running, image pull included
+    "run": ("running", "completed"),  # container running to its completion
+    "reap": ("completed", "reaped"),  # completion to the deletion by the reaper
+}
+
+# event queue of each /stream subscriber, fed by publish_cluster_state
+stream_subscribers = set()
+background_tasks = set()  # keeps a reference to the asyncio tasks started at startup
+
+
+def set_node_capacity(node):
+    """Store the CPU and memory capacity of a V1Node in the cache, if the node reports them."""
+    node_name = node.metadata.name
+    with node_capacity_lock:
+        node_names.add(node_name)
+    if node.status is None or not node.status.capacity or "cpu" not in node.status.capacity:
+        logging.warning(f"Node {node_name} reports no CPU capacity yet")
+        return None
+    cpu_capacity_nanocores = parse_cpu(node.status.capacity["cpu"])
+    memory_capacity_bytes = parse_memory(node.status.capacity["memory"]) if "memory" in node.status.capacity else None
+    with node_capacity_lock:
+        if node_capacity.get(node_name) != cpu_capacity_nanocores:
+            logging.info(f"CPU capacity for node {node_name} : {cpu_capacity_nanocores / 1e9}")
+        node_capacity[node_name] = cpu_capacity_nanocores
+        if memory_capacity_bytes is not None:
+            node_memory_capacity[node_name] = memory_capacity_bytes
+    return cpu_capacity_nanocores
+
+
+def drop_node_capacity(node_name: str):
+    with node_capacity_lock:
+        node_names.discard(node_name)
+        node_memory_capacity.pop(node_name, None)
+        if node_capacity.pop(node_name, None) is not None:
+            logging.info(f"Dropped cached CPU capacity for node {node_name}")
+
+
+def load_node_capacity(api_instance):
+    """Fill the capacity cache from a single node list, return the list resource version."""
+    nodes_all = api_instance.list_node()
+    listed_nodes = {node.metadata.name for node in nodes_all.items}
+    for node in nodes_all.items:
+        set_node_capacity(node)
+    with node_capacity_lock:
+        node_names.intersection_update(listed_nodes)
+        for node_name in list(node_capacity):
+            if node_name not in listed_nodes:
+                node_capacity.pop(node_name)
+                node_memory_capacity.pop(node_name, None)
+    return nodes_all.metadata.resource_version
+
+
+def handle_node_event(event_type: str, node):
+    if event_type == "DELETED":
+        drop_node_capacity(node.metadata.name)
     else:
-        logging.error(f"Failed to retrieve node capacity for {node_name}: {result.stderr}")
+        set_node_capacity(node)
+
+
+def run_watch(kind: str, list_func, load, handle_event, resync_interval: int, *args):
+    """Run `load` for a full list, then apply watch events until the watch expires, forever.
+
+    Every expiry (each `resync_interval` seconds) or failure goes back to a full list,
+    so a missed event can only leave the cache stale until the next resync.
+    """
+    while True:
+        try:
+            resource_version = load()
+            w = watch.Watch()
+            for event in w.stream(
+                list_func,
+                *args,
+                resource_version=resource_version,
+                timeout_seconds=resync_interval,
+            ):
+                if event["type"] == "ERROR":
+                    logging.warning(f"{kind} watch error event, re-listing: {event['object']}")
+                    break
+                handle_event(event["type"], event["object"])
+        except Exception as e:
+            logging.error(f"{kind} watch failed, re-listing in {watch_retry_delay}s: {e}")
+            time.sleep(watch_retry_delay)
+
+
+def watch_nodes():
+    """Keep the node capacity cache current from a node watch."""
+    run_watch(
+        "Node",
+        core_api.list_node,
+        lambda: load_node_capacity(core_api),
+        handle_node_event,
+        node_watch_timeout,
+    )
+
+
+def get_node_names():
+    with node_capacity_lock:
+        return sorted(node_names)
+
+
+def get_node_capacity(node_name: str, resource: str = "cpu"):
+    """
+    Return the CPU capacity of a node in nanocores, or its memory capacity in bytes,
+    reading the node only on a cache miss.
+    """
+    capacity = node_capacity if resource == "cpu" else node_memory_capacity
+    with node_capacity_lock:
+        value = capacity.get(node_name)
+    if value is not None:
+        return value
+    try:
+        set_node_capacity(core_api.read_node(node_name))
+    except client.ApiException as e:
+        logging.error(f"Failed to retrieve node capacity for {node_name}: {e}")
         return None
+    with node_capacity_lock:
+        return capacity.get(node_name)
+
+
+def index_pod(pod):
+    """Add or update a V1Pod in the pod index."""
+    node_name = pod.spec.node_name
+    if node_name is None:
+        # not bound to a node yet, it will be indexed by the event that binds it
+        return
+    if pod.metadata.deletion_timestamp is not None and pod.status.phase in ["Succeeded", "Failed"]:
+        # a completed pod being deleted, already removed from the index by whoever deleted it
+        unindex_pod(pod.metadata.name, node_name)
+        return
+    with pod_index_lock:
+        pod_index.setdefault(node_name, {})[pod.metadata.name] = pod.status.phase
+
+
+def unindex_pod(pod_name: str, node_name: str):
+    with pod_index_lock:
+        pods = pod_index.get(node_name)
+        if pods is not None:
+            pods.pop(pod_name, None)
+
+
+def handle_pod_event(event_type: str, pod):
+    if event_type == "DELETED":
+        unindex_pod(pod.metadata.name, pod.spec.node_name)
+        if pod.status is not None and pod.status.phase in ("Succeeded", "Failed"):
+            # deleted by the reaper, the watch may get here before reap_completed_pods does;
+            # only the first of the two finds the timings
+            record_pod_status(pod)
+            record_pod_reaped(pod.metadata.name)
+        else:
+            with pod_timings_lock:
+                # deleted while still running, e.g. evicted
+                pod_timings.pop(pod.metadata.name, None)
+    else:
+        index_pod(pod)
+        record_pod_status(pod)
+
+
+def record_pod_created(pod_name: str, node_name: str):
+    with pod_timings_lock:
+        if len(pod_timings) >= pod_timings_limit:
+            # drop the oldest, its reap was missed
+            pod_timings.pop(next(iter(pod_timings)))
+        pod_timings[pod_name] = {"node": node_name, "created": time.time()}
+
+
+def forget_pod_created(pod_name: str):
+    """Drop the timings of a pod whose creation failed, it will never be reaped."""
+    with pod_timings_lock:
+        pod_timings.pop(pod_name, None)
+
+
+def record_pod_status(pod):
+    """Record the first time a tracked V1Pod is seen scheduled, running and completed."""
+    status = pod.status
+    steps = {}
+    for condition in status.conditions or []:
+        if condition.type == "PodScheduled" and condition.status == "True" and condition.last_transition_time:
+            steps["scheduled"] = condition.last_transition_time.timestamp()
+    for container in status.container_statuses or []:
+        state = container.state
+        if state.running is not None and state.running.started_at:
+            steps["running"] = state.running.started_at.timestamp()
+        if state.terminated is not None:
+            if state.terminated.started_at:
+                steps["running"] = state.terminated.started_at.timestamp()
+            if state.terminated.finished_at:
+                steps["completed"] = state.terminated.finished_at.timestamp()
+    with pod_timings_lock:
+        timings = pod_timings.get(pod.metadata.name)
+        if timings is not None:
+            for step, timestamp in steps.items():
+                timings.setdefault(step, timestamp)
+
+
+def record_pod_reaped(pod_name: str):
+    """Add the lifecycle of a reaped pod to the latency histograms of its node."""
+    with pod_timings_lock:
+        timings = pod_timings.pop(pod_name, None)
+        if timings is None:
+            return
+        timings["reaped"] = time.time()
+        histograms = pod_latency.setdefault(
+            timings["node"], {interval: Histogram() for interval in pod_latency_intervals}
+        )
+    for interval, (start, end) in pod_latency_intervals.items():
+        if start in timings and end in timings:
+            # Kubernetes timestamps have a one second resolution
+            histograms[interval].observe(max(0.0, timings[end] - timings[start]))
+
+
+def load_pod_index(api_instance):
+    """Rebuild the pod index from a single pod list, return the list resource version."""
+    pod_list = api_instance.list_namespaced_pod("default")
+    new_index = {}
+    for pod in pod_list.items:
+        if pod.spec.node_name is not None:
+            new_index.setdefault(pod.spec.node_name, {})[pod.metadata.name] = pod.status.phase
+    with pod_index_lock:
+        pod_index.clear()
+        pod_index.update(new_index)
+    logging.debug(f"Pod index resynced: {sum(len(pods) for pods in new_index.values())} pods")
+    return pod_list.metadata.resource_version
+
+
+def watch_pods():
+    """Keep the pod index current from a pod watch on the "default" namespace."""
+    run_watch(
+        "Pod",
+        core_api.list_namespaced_pod,
+        lambda: load_pod_index(core_api),
+        handle_pod_event,
+        pod_resync_interval,
+        "default",
+    )
+
+
+def count_all_pods():
+    with pod_index_lock:
+        return {node_name: len(pods) for node_name, pods in pod_index.items()}
+
+
+def count_node_pods(node_name: str):
+    with pod_index_lock:
+        return len(pod_index.get(node_name, {}))
+
+
+def get_node_pods(node_name: str):
+    """Return the names of the indexed pods on a node."""
+    with pod_index_lock:
+        return list(pod_index.get(node_name, {}))
+
+
+def get_completed_pods():
+    """Return (pod name, node name) for every indexed pod that has Succeeded or Failed."""
+    with pod_index_lock:
+        return [
+            (pod_name, node_name)
+            for node_name, pods in pod_index.items()
+            for pod_name, phase in pods.items()
+            if phase in ["Succeeded", "Failed"]
+        ]
+
+
+def record_deleted_pod(pod_name: str, node_name: str):
+    global deleted_seq
+    with deleted_pods_lock:
+        if node_name not in deleted_pods:
+            deleted_pods[node_name] = deque(maxlen=deleted_pods_history)
+        if any(name == pod_name for _, name in deleted_pods[node_name]):
+            # a stale watch event re-indexed a pod that was already reaped
+            return
+        deleted_seq += 1
+        deleted_pods[node_name].append((deleted_seq, pod_name))
+
+
+def get_deleted_pods(node_name: str, since=None):
+    """Return the pods reaped on a node after sequence number `since`, and the latest sequence number.
+
+    Without `since`, every reaped pod is returned once: the pods not returned by a previous
+    call for the same node.
+    """
+    with deleted_pods_lock:
+        if since is None:
+            since = reported_seq.get(node_name, 0)
+            reported_seq[node_name] = deleted_seq
+        names = [pod_name for seq, pod_name in deleted_pods.get(node_name, ()) if seq > since]
+        return names, deleted_seq
 
-def parse_input(input_str: str):
-    args = re.findall(r"--([a-zA-Z-]+)\s+([^\s]+)", input_str)
-    args = {arg[0]: arg[1] for arg in args}
-    logging.debug(f"Parsed input arguments: {args}")
-    return args
+
+def get_all_deleted_pods(since: int = 0):
+    """Return {node: pods reaped after sequence number `since`} and the latest sequence number."""
+    with deleted_pods_lock:
+        names = {
+            node_name: [pod_name for seq, pod_name in pods if seq > since]
+            for node_name, pods in deleted_pods.items()
+        }
+        return {node_name: pods for node_name, pods in names.items() if pods}, deleted_seq
+
+
+def delete_completed_pod(api_instance, pod_name: str):
+    try:
+        api_instance.delete_namespaced_pod(pod_name, "default")
+        return True
+    except client.ApiException as e:
+        if e.status == 404:
+            # already gone
+            return True
+        logging.error(f"Error deleting pod {pod_name}: {e}")
+        return False
+
+
+def reap_completed_pods(api_instance):
+    """Delete every completed pod in the pod index concurrently, return the deleted pod names."""
+    with reap_lock:
+        completed_pods = get_completed_pods()
+        if not completed_pods:
+            return []
+        results = reap_executor.map(
+            lambda pod: delete_completed_pod(api_instance, pod[0]), completed_pods
+        )
+        deleted_pod_names = []
+        for (pod_name, node_name), ok in zip(completed_pods, results):
+            if ok:
+                unindex_pod(pod_name, node_name)
+                record_deleted_pod(pod_name, node_name)
+                record_pod_reaped(pod_name)
+                deleted_pod_names.append(pod_name)
+        logging.info(f"Deleted pods: {deleted_pod_names}")
+        return deleted_pod_names
 
 
-def start_new_pod(args: dict, pod_name: str, node_name: str):
+def reap_pods():
+    """Background reaper, keeps the deletion of completed pods off the request path."""
+    while True:
+        try:
+            reap_completed_pods(core_api)
+        except Exception as e:
+            logging.error(f"Error reaping completed pods: {e}")
+        time.sleep(reap_interval)
+
+
+async def run_k8s(func, *args, **kwargs):
+    """Run a blocking Kubernetes call on the bounded k8s_executor, off the event loop."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(k8s_executor, functools.partial(func, *args, **kwargs))
+
+
+# tolerated by the stress-ng and pre-pull pods, so they can run on the master node
+control_plane_tolerations = [
+    {
+        "key": "node-role.kubernetes.io/control-plane",
+        "operator": "Exists",
+        "effect": "NoSchedule",
+    }
+]
+
+
+def build_pod_template():
+    """return the parts of the stress-ng pod manifest shared by every pod"""
+    container = {
+        "name": "stress-ng-container",
+        "image": stress_image,
+        "imagePullPolicy": stress_image_pull_policy,
+    }
+    if stress_resources:
+        container["resources"] = stress_resources
+    spec = {
+        "tolerations": control_plane_tolerations,
+        "restartPolicy": "Never",
+    }
+    return container, spec
+
+
+pod_container_template, pod_spec_template = build_pod_template()
+
+
+def start_new_pod(job: Job, pod_name: str, node_name: str):
     unique_suffix = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
     new_pod_name = f"stress-ng-pod-{unique_suffix}-{pod_name}"
-    stress_values = ["stress-ng"]
-
-    if "cpu" in args:
-        stress_values.extend(["--cpu", args["cpu"]])
-    if "io" in args:
-        stress_values.extend(["--io", args["io"]])
-    if "vm" in args:
-        stress_values.extend(["--vm", args["vm"], "--vm-bytes", args.get("vm-bytes", "1G")])
-    stress_values.append("--timeout")
-    stress_values.append(args["timeout"])
+    stress_values = ["stress-ng"] + job.stress_args()
 
+    # only the name, node and args differ between pods, the rest is shared with the template
     pod_manifest = {
         "apiVersion": "v1",
         "kind": "Pod",
         "metadata": {"name": new_pod_name},
         "spec": {
+            **pod_spec_template,
             "nodeName": node_name,
-            "tolerations": [
-                {
-                    "key": "node-role.kubernetes.io/control-plane",
-                    "operator": "Exists",
-                    "effect": "NoSchedule",
-                }
-            ],
-            "containers": [
-                {
-                    "name": "stress-ng-container",
-                    "image": "polinux/stress-ng:latest",
-                    "args": stress_values,
-                }
-            ],
-            "restartPolicy": "Never",
+            "containers": [{**pod_container_template, "args": stress_values}],
         },
     }
 
-    api_instance = client.CoreV1Api()
+    # recorded before the create call, the watch can report the pod before the call returns
+    record_pod_created(new_pod_name, node_name)
     try:
-        api_response = api_instance.create_namespaced_pod(namespace="default", body=pod_manifest)
+        api_response = core_api.create_namespaced_pod(namespace="default", body=pod_manifest)
         logging.info(f"Pod {new_pod_name} successfully created with status: {api_response.status}")
         return {"success": True, "msg": f"Pod {new_pod_name} created."}
     except client.ApiException as e:
+        forget_pod_created(new_pod_name)
         logging.error(f"Error while creating pod {new_pod_name}: {e}")
         return {"success": False, "msg": str(e)}
+    except Exception:
+        forget_pod_created(new_pod_name)
+        raise
 
 
-@app.get("/cpu")
-async def get_cpu():
-    usage = {}
-    api = client.CustomObjectsApi()
-    k8s_nodes = api.list_cluster_custom_object("metrics.k8s.io", "v1beta1", "nodes")
+def create_prepull_daemonset():
+    """create (or update) the DaemonSet pulling stress_image on every node
+
+    Its init container pulls the image and exits, then a pause container keeps the pod, and
+    so the image, on the node. Pod starts then skip the registry pull.
+    """
+    labels = {"app": prepull_daemonset_name}
+    body = {
+        "apiVersion": "apps/v1",
+        "kind": "DaemonSet",
+        "metadata": {"name": prepull_daemonset_name, "labels": labels},
+        "spec": {
+            "selector": {"matchLabels": labels},
+            "template": {
+                "metadata": {"labels": labels},
+                "spec": {
+                    "tolerations": control_plane_tolerations,
+                    "initContainers": [
+                        {
+                            "name": "prepull",
+                            "image": stress_image,
+                            "imagePullPolicy": stress_image_pull_policy,
+                            "command": ["stress-ng", "--version"],
+                        }
+                    ],
+                    "containers": [
+                        {
+                            "name": "pause",
+                            "image": prepull_pause_image,
+                            "resources": {"requests": {"cpu": "1m", "memory": "4Mi"}},
+                        }
+                    ],
+                },
+            },
+        },
+    }
+    try:
+        apps_api.create_namespaced_daemon_set(namespace=prepull_namespace, body=body)
+        logging.info(f"Created the {prepull_daemonset_name} DaemonSet pulling {stress_image}")
+    except client.ApiException as e:
+        if e.status != 409:
+            logging.error(f"Error creating the {prepull_daemonset_name} DaemonSet: {e}")
+            return
+        try:
+            apps_api.replace_namespaced_daemon_set(prepull_daemonset_name, prepull_namespace, body)
+            logging.info(f"Updated the {prepull_daemonset_name} DaemonSet to pull {stress_image}")
+        except client.ApiException as e:
+            logging.error(f"Error updating the {prepull_daemonset_name} DaemonSet: {e}")
+
+
+@app.on_event("startup")
+async def start_watchers():
+    node_watch_thread = threading.Thread(target=watch_nodes)
+    node_watch_thread.daemon = True
+    node_watch_thread.start()
+    pod_watch_thread = threading.Thread(target=watch_pods)
+    pod_watch_thread.daemon = True
+    pod_watch_thread.start()
+    reaper_thread = threading.Thread(target=reap_pods)
+    reaper_thread.daemon = True
+    reaper_thread.start()
+    background_tasks.add(asyncio.create_task(publish_cluster_state()))
+    if prepull_image:
+        k8s_executor.submit(create_prepull_daemonset)
+
+
+def parse_sample_time(stats):
+    """Return (timestamp, window) of a metrics.k8s.io item: the epoch seconds of the end of its
+    sampling window and the window length in seconds, None for a missing or invalid field."""
+    timestamp = window = None
+    try:
+        timestamp = datetime.datetime.fromisoformat(stats["timestamp"].replace("Z", "+00:00")).timestamp()
+    except (KeyError, ValueError, AttributeError):
+        pass
+    if isinstance(stats.get("window"), str):
+        # a Go duration, e.g. "10.5s" or "1m0s"
+        parts = go_duration_pattern.findall(stats["window"])
+        if parts:
+            window = sum(float(value) * go_duration_units[unit] for value, unit in parts)
+    return timestamp, window
+
+
+def fetch_metrics(kind: str):
+    if kind == "nodes":
+        metrics = custom_api.list_cluster_custom_object("metrics.k8s.io", "v1beta1", "nodes")
+    else:
+        metrics = custom_api.list_namespaced_custom_object("metrics.k8s.io", "v1beta1", "default", "pods")
+    samples = {stats["metadata"]["name"]: parse_sample_time(stats) for stats in metrics["items"]}
+    return metrics, samples
+
+
+def list_metrics(kind: str):
+    """
+    Return the metrics.k8s.io list of the "nodes" or of the "default" namespace "pods" and the
+    {name: (timestamp, window)} of its items, reused for metrics_ttl seconds.
+
+    Callers arriving while the list is fetched wait for that fetch instead of starting their own,
+    so the apiserver sees at most one metrics request per kind at a time.
+    """
+    with metrics_cache_lock:
+        cached = metrics_cache.get(kind)
+        if cached is not None and time.monotonic() - cached[0] < metrics_ttl:
+            metrics_cache_stats[kind]["hits"] += 1
+            return cached[1], cached[2]
+        future = metrics_inflight.get(kind)
+        leader = future is None
+        if leader:
+            future = metrics_inflight[kind] = Future()
+            metrics_cache_stats[kind]["fetches"] += 1
+        else:
+            metrics_cache_stats[kind]["coalesced"] += 1
+    if not leader:
+        return future.result()
+    try:
+        metrics, samples = fetch_metrics(kind)
+        with metrics_cache_lock:
+            metrics_cache[kind] = (time.monotonic(), metrics, samples)
+        future.set_result((metrics, samples))
+        return metrics, samples
+    except Exception as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with metrics_cache_lock:
+            metrics_inflight.pop(kind, None)
+
+
+def get_node_usage():
+    """
+    Return the CPU and memory usage of every node in percent, from one metrics.k8s.io list,
+    and the {node: (timestamp, window)} of each node sample.
+    """
+    cpu_usage, memory_usage = {}, {}
+    k8s_nodes, samples = list_metrics("nodes")
     for stats in k8s_nodes["items"]:
         node_name = stats["metadata"]["name"]
-        cpu_usage_nanoseconds = int(stats["usage"]["cpu"].rstrip("n"))
+        try:
+            cpu_usage_nanocores = parse_cpu(stats["usage"]["cpu"])
+            memory_usage_bytes = parse_memory(stats["usage"]["memory"])
+        except (KeyError, ValueError) as e:
+            logging.error(f"Invalid usage for node {node_name}: {e}")
+            continue
         cpu_capacity_nanocores = get_node_capacity(node_name)
         if cpu_capacity_nanocores:
-            usage[node_name] = (cpu_usage_nanoseconds / cpu_capacity_nanocores) * 100
-    return usage
+            cpu_usage[node_name] = (cpu_usage_nanocores / cpu_capacity_nanocores) * 100
+        memory_capacity_bytes = get_node_capacity(node_name, "memory")
+        if memory_capacity_bytes:
+            memory_usage[node_name] = (memory_usage_bytes / memory_capacity_bytes) * 100
+    return cpu_usage, memory_usage, {node_name: samples[node_name] for node_name in cpu_usage}
+
+
+@app.get("/cpu")
+async def get_cpu(memory: bool = False):
+    """
+    Return the CPU usage (percent) of every node, or with memory=true
+    {"cpu", "memory", "metrics_timestamp", "metrics_window"} per node from the same metrics list.
+    """
+    cpu_usage, memory_usage, samples = await run_k8s(get_node_usage)
+    if memory:
+        return {
+            "cpu": cpu_usage,
+            "memory": memory_usage,
+            "metrics_timestamp": {node_name: timestamp for node_name, (timestamp, _) in samples.items()},
+            "metrics_window": {node_name: window for node_name, (_, window) in samples.items()},
+        }
+    return cpu_usage
+
+
+@app.get("/metrics-cache")
+async def get_metrics_cache():
+    """Return the fetches, cache hits and coalesced calls of each metrics list, and the age of the cached lists."""
+    with metrics_cache_lock:
+        age = {kind: time.monotonic() - cached[0] for kind, cached in metrics_cache.items()}
+        stats = {kind: dict(counts) for kind, counts in metrics_cache_stats.items()}
+    return {"success": True, "msg": "", "ttl": metrics_ttl, "stats": stats, "age": age}
+
+
+def get_pod_usage():
+    """
+    Return {node: {"total", "managed", "other", "pods"}}: the CPU usage (percent) of every node,
+    the part used by the pods of the pod index (the stress-ng jobs), the rest (system daemons,
+    other namespaces) and the number of managed pods with metrics.
+    """
+    cpu_usage, _, _ = get_node_usage()
+    with pod_index_lock:
+        pod_nodes = {pod_name: node_name for node_name, pods in pod_index.items() for pod_name in pods}
+    managed = {node_name: 0.0 for node_name in cpu_usage}
+    managed_pods = {node_name: 0 for node_name in cpu_usage}
+    for stats in list_metrics("pods")[0]["items"]:
+        pod_name = stats["metadata"]["name"]
+        node_name = pod_nodes.get(pod_name)
+        if node_name not in managed:
+            continue
+        try:
+            cpu_usage_nanocores = sum(parse_cpu(container["usage"]["cpu"]) for container in stats["containers"])
+        except (KeyError, ValueError) as e:
+            logging.error(f"Invalid usage for pod {pod_name}: {e}")
+            continue
+        cpu_capacity_nanocores = get_node_capacity(node_name)
+        if cpu_capacity_nanocores:
+            managed[node_name] += (cpu_usage_nanocores / cpu_capacity_nanocores) * 100
+            managed_pods[node_name] += 1
+    return {
+        node_name: {
+            "total": total,
+            "managed": managed[node_name],
+            # node and pod metrics are not sampled at the same instant, the difference can dip below 0
+            "other": max(0.0, total - managed[node_name]),
+            "pods": managed_pods[node_name],
+        }
+        for node_name, total in cpu_usage.items()
+    }
+
+
+@app.get("/pod-cpu")
+async def get_pod_cpu():
+    """Return the CPU usage (percent) of every node split into its managed pods and everything else."""
+    try:
+        return {"success": True, "msg": "", "nodes": await run_k8s(get_pod_usage)}
+    except Exception as e:
+        logging.error(f"Error in get_pod_cpu: {e}")
+        return {"success": False, "msg": str(e), "nodes": {}}
+
+
+def get_cluster_state_snapshot(since: int):
+    """Build the /cluster-state snapshot: one metrics.k8s.io list, everything else from memory."""
+    cpu_usage, memory_usage, samples = get_node_usage()
+    nodes_list = get_node_names()
+    pod_num = count_all_pods()
+    deleted_pod_names, seq = get_all_deleted_pods(since)
+    return {
+        "success": True,
+        "timestamp": time.time(),
+        "nodes": nodes_list,
+        "cpu": cpu_usage,
+        "memory": memory_usage,
+        # end and length in seconds of the metrics-server window of each CPU value, an unchanged
+        # timestamp means the value is a repeat of the previous sample
+        "metrics_timestamp": {node_name: timestamp for node_name, (timestamp, _) in samples.items()},
+        "metrics_window": {node_name: window for node_name, (_, window) in samples.items()},
+        "pod_num": {node_name: pod_num.get(node_name, 0) for node_name in nodes_list},
+        "deleted_pods": deleted_pod_names,
+        "deleted_seq": seq,
+    }
+
+
+def diff_cluster_state(old, new):
+    """Return the changes from snapshot `old` to snapshot `new`, or None if nothing changed.
+
+    Changed nodes carry their new absolute values, so applying a delta twice is harmless.
+    """
+    delta = {"timestamp": new["timestamp"], "deleted_seq": new["deleted_seq"]}
+    if old is None or old["nodes"] != new["nodes"]:
+        delta["nodes"] = new["nodes"]
+    for key in ["cpu", "memory", "metrics_timestamp", "metrics_window", "pod_num"]:
+        changed = {
+            node_name: value
+            for node_name, value in new[key].items()
+            if old is None or old[key].get(node_name) != value
+        }
+        if changed:
+            delta[key] = changed
+    if new["deleted_pods"]:
+        delta["deleted_pods"] = new["deleted_pods"]
+    if len(delta) == 2:
+        return None
+    return delta
+
+
+async def publish_cluster_state():
+    """Push the cluster state changes to the /stream subscribers every stream_interval seconds."""
+    last_snapshot = None
+    while True:
+        await asyncio.sleep(stream_interval)
+        if not stream_subscribers:
+            # a new subscriber starts from its own full snapshot, the pods reaped until then
+            # must not be replayed to it as a change
+            last_snapshot = None
+            continue
+        try:
+            since = last_snapshot["deleted_seq"] if last_snapshot is not None else deleted_seq
+            snapshot = await run_k8s(get_cluster_state_snapshot, since)
+        except Exception as e:
+            logging.error(f"Error building the stream snapshot: {e}")
+            continue
+        delta = diff_cluster_state(last_snapshot, snapshot)
+        last_snapshot = snapshot
+        if delta is None:
+            continue
+        for queue in list(stream_subscribers):
+            if queue.qsize() < stream_queue_size:
+                queue.put_nowait(delta)
+            else:
+                # a subscriber that can't keep up is disconnected, it gets a full snapshot on reconnect,
+                # the queue has one extra slot for the None that ends its stream
+                logging.warning("Dropping a /stream subscriber that is not reading its events")
+                stream_subscribers.discard(queue)
+                queue.put_nowait(None)
+
+
+@app.get("/cluster-state")
+async def get_cluster_state(since: int = 0):
+    """
+    Returns the node list, the CPU and memory usage (percent) and pod number of every node, and the pods
+    reaped after sequence number `since`, all in one response.
+    """
+    try:
+        return await run_k8s(get_cluster_state_snapshot, since)
+    except Exception as e:
+        logging.error(f"Error in get_cluster_state: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/stream")
+async def stream_cluster_state(request: Request, since: int = None):
+    """
+    Server-Sent Events stream of the cluster state: a full /cluster-state snapshot first, then
+    only the nodes whose CPU or memory usage or pod number changed, and the newly reaped pods.
+    """
+    queue = asyncio.Queue(maxsize=stream_queue_size + 1)
+    stream_subscribers.add(queue)
+    if since is None:
+        since = deleted_seq
+
+    async def events():
+        try:
+            snapshot = await run_k8s(get_cluster_state_snapshot, since)
+            yield f"data: {json.dumps(snapshot)}\n\n"
+            while not await request.is_disconnected():
+                try:
+                    delta = await asyncio.wait_for(queue.get(), timeout=stream_keepalive)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                if delta is None:
+                    break
+                yield f"data: {json.dumps(delta)}\n\n"
+        finally:
+            stream_subscribers.discard(queue)
+
+    return StreamingResponse(events(), media_type="text/event-stream")
 
 
 @app.post("/pod")
 async def handle_post(request: Request):
     data = await request.json()
-    job_desc = data.get("job")
+    job, msg = job_from_payload(data.get("job"))
+    if job is None:
+        logging.error(f"Invalid job: {msg}")
+        return JSONResponse(content={"success": False, "msg": msg})
     pod_name = data.get("name")
     node_name = data.get("node")
-    args = parse_input(job_desc)
-    response = start_new_pod(args, pod_name, node_name)
+    response = await run_k8s(start_new_pod, job, pod_name, node_name)
     return JSONResponse(content=response)
 
 
+@app.post("/pods")
+async def create_pods(request: Request):
+    """Create a batch of pods, {"pods": [{"job", "name", "node"}, ...]}, concurrently.
+
+    Returns one {"name", "success", "msg"} result per pod, in request order.
+    """
+    data = await request.json()
+    semaphore = asyncio.Semaphore(pod_create_parallelism)
+
+    async def create(entry):
+        pod_name = entry.get("name")
+        job, msg = job_from_payload(entry.get("job"))
+        if job is None:
+            logging.error(f"Invalid job for pod {pod_name}: {msg}")
+            return {"name": pod_name, "success": False, "msg": msg}
+        try:
+            async with semaphore:
+                res = await run_k8s(start_new_pod, job, pod_name, entry.get("node"))
+            return {"name": pod_name, "success": res["success"], "msg": res["msg"]}
+        except Exception as e:
+            logging.error(f"Error while creating pod {pod_name}: {e}")
+            return {"name": pod_name, "success": False, "msg": str(e)}
+
+    results = await asyncio.gather(*(create(entry) for entry in data.get("pods", [])))
+    return {
+        "success": all(result["success"] for result in results),
+        "msg": "",
+        "results": list(results),
+    }
+
+
+@app.get("/pod-latency")
+async def get_pod_latency():
+    """Return, per node, the histograms of the seconds between the lifecycle steps of its pods."""
+    with pod_timings_lock:
+        nodes = {
+            node_name: {interval: histogram.snapshot() for interval, histogram in histograms.items()}
+            for node_name, histograms in pod_latency.items()
+        }
+    return {"success": True, "msg": "", "intervals": pod_latency_intervals, "nodes": nodes}
+
+
 @app.get("/nodes")
 async def get_nodes():
-    api_instance = client.CoreV1Api()
     try:
-        nodes_all = api_instance.list_node()
+        nodes_all = await run_k8s(core_api.list_node)
         nodes_list = [node.metadata.name for node in nodes_all.items]
         logging.info(f"Retrieved nodes: {nodes_list}")
         return {"success": True, "nodes": nodes_list}
@@ -125,17 +912,14 @@ async def get_nodes():
 async def get_pod_num(request: Request):
     data = await request.json()
     node_name = data.get("node")
-    api_instance = client.CoreV1Api()
 
     try:
-        # Delete completed/failed pods
-        deleted_pods = delete_pods()
+        # Completed/failed pods are deleted by the reaper, only report them here
+        deleted_pod_names, seq = get_deleted_pods(node_name, data.get("since"))
         # Count pods on the node
-        field_selector = f"spec.nodeName={node_name}"
-        pod_list = api_instance.list_namespaced_pod(namespace="default", field_selector=field_selector)
-        pod_count = len(pod_list.items)
+        pod_count = count_node_pods(node_name)
         logging.info(f"Total pods on node {node_name}: {pod_count}")
-        return {"pod_num": pod_count, "deleted_pods": deleted_pods}
+        return {"pod_num": pod_count, "deleted_pods": deleted_pod_names, "deleted_seq": seq}
     except Exception as e:
         logging.error(f"Error in get_pod_num: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -145,14 +929,14 @@ async def get_pod_num(request: Request):
 async def delete_node(request: Request):
     data = await request.json()
     node_name = data.get("node")
-    api_instance = client.CoreV1Api()
 
     try:
         # Evict pods before deleting the node
-        evict_pods(node_name, api_instance)
+        await run_k8s(evict_pods, node_name, core_api)
 
         # Delete the node
-        api_instance.delete_node(node_name)
+        await run_k8s(core_api.delete_node, node_name)
+        drop_node_capacity(node_name)
         logging.info(f"Deleted node: {node_name}")
         return {"success": True, "msg": f"Node {node_name} deleted."}
     except Exception as e:
@@ -164,7 +948,6 @@ async def delete_node(request: Request):
 async def start_node(request: Request):
     data = await request.json()
     node_name = data.get("node")
-    api_instance = client.CoreV1Api()
     metadata = client.V1ObjectMeta(name=node_name)
     node_spec = client.V1NodeSpec()
     node = client.V1Node(metadata=metadata, spec=node_spec)
@@ -172,7 +955,7 @@ async def start_node(request: Request):
     try:
         # Create the node
         if node_name!="node0":
-            api_instance.create_node(node)
+            await run_k8s(core_api.create_node, node)
             logging.info(f"Started node: {node_name}")
             return {"success": True, "msg": f"Node {node_name} started."}
         else:
@@ -182,19 +965,12 @@ async def start_node(request: Request):
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/delete-pods")
-def delete_pods():
+async def delete_pods():
     """
     Deletes completed or failed pods in the "default" namespace.
     """
-    api_instance = client.CoreV1Api()
     try:
-        pod_list = api_instance.list_namespaced_pod("default")
-        deleted_pod_names = []
-        for pod in pod_list.items:
-            if pod.status.phase in ["Succeeded", "Failed"]:
-                api_instance.delete_namespaced_pod(pod.metadata.name, "default")
-                deleted_pod_names.append(pod.metadata.name)
-        logging.info(f"Deleted pods: {deleted_pod_names}")
+        deleted_pod_names = await run_k8s(reap_completed_pods, core_api)
         return {"success": True, "deleted_pods": deleted_pod_names}
     except Exception as e:
         logging.error(f"Error deleting pods: {e}")
@@ -203,15 +979,13 @@ def delete_pods():
 
 
 def evict_pods(node_name: str, api_instance):
-    pods = api_instance.list_namespaced_pod("default")
-    pods_on_node = [pod for pod in pods.items if pod.spec.node_name == node_name]
-
-    for pod in pods_on_node:
+    for pod_name in get_node_pods(node_name):
         try:
-            api_instance.delete_namespaced_pod(name=pod.metadata.name, namespace=pod.metadata.namespace)
-            logging.info(f"Evicted pod {pod.metadata.name} from node {node_name}")
+            api_instance.delete_namespaced_pod(name=pod_name, namespace="default")
+            unindex_pod(pod_name, node_name)
+            logging.info(f"Evicted pod {pod_name} from node {node_name}")
         except Exception as e:
-            logging.error(f"Error evicting pod {pod.metadata.name}: {e}")
+            logging.error(f"Error evicting pod {pod_name}: {e}")
 
 
 # Main entry point to run the application
@@ -0,0 +1,186 @@
+import argparse
+import csv
+import logging
+import time
+
+import numpy as np
+
+# settings, the plant model of one node
+max_pod_upperbound = 7  # same bound as the local controllers
+cpu_per_pod = 0.12  # CPU fraction of the node used by one running stress-ng pod
+baseline_cpu = 0.03  # CPU fraction used by the system daemons
+pod_start_delay = 8  # seconds between a max_pod increase and the new pods using CPU
+job_duration = 120  # mean seconds a pod runs, pods above max_pod finish at that rate
+metrics_window = 15  # time constant in seconds of the metrics-server CPU average
+settle_band = 0.05  # the CPU is settled once it stays within X of the reference input
+dt = 1.0  # simulation step in seconds
+
+
+def parse_values(spec):
+    """Parse "start:stop:num" (inclusive linspace) or "a,b,c" into a list of floats."""
+    if ":" in spec:
+        start, stop, num = spec.split(":")
+        return list(np.linspace(float(start), float(stop), int(num)))
+    return [float(value) for value in spec.split(",")]
+
+
+def load_trace(file_name, column=-1, step=1.0, pods=False):
+    """Load a recorded trace as a background CPU fraction sampled every dt seconds.
+
+    Reads one value per line from `column` of comma separated rows (cpu.txt, the global
+    controller files, controller_record.csv), skipping headers and comments. Rows are `step`
+    seconds apart. With pods set, values are pod counts (e.g. node0cur_podvstime.txt) and are
+    converted to CPU with cpu_per_pod.
+    """
+    values = []
+    with open(file_name, "r") as file:
+        for line in file:
+            fields = line.strip().split(",")
+            try:
+                values.append(float(fields[column]))
+            except (ValueError, IndexError):
+                continue
+    trace = np.asarray(values, dtype=float)
+    if pods:
+        trace = trace * cpu_per_pod
+    times = np.arange(len(trace)) * step
+    return np.interp(np.arange(0, times[-1] + step, dt), times, trace)
+
+
+def synthetic_trace(kind, duration):
+    """Background CPU fraction for a synthetic scenario: "none", "step" or "sine"."""
+    t = np.arange(0, duration, dt)
+    if kind == "none":
+        return np.zeros_like(t)
+    if kind == "step":
+        return np.where(t >= duration / 2, 0.3, 0.0)
+    if kind == "sine":
+        return 0.15 + 0.15 * np.sin(2 * np.pi * t / 600)
+    raise ValueError(f"unknown synthetic trace {kind}")
+
+
+def make_grid(kp, ki, kd, reference_input, sample_rate):
+    """Cartesian product of the value lists, as flat arrays with one entry per combination."""
+    mesh = np.meshgrid(kp, ki, kd, reference_input, sample_rate, indexing="ij")
+    return {
+        name: values.ravel()
+        for name, values in zip(["kp", "ki", "kd", "reference_input", "sample_rate"], mesh)
+    }
+
+
+def evaluate(grid, disturbance):
+    """Simulate every gain combination of grid against the disturbance trace at once.
+
+    The controller update is PIDController.compute vectorized, as closed_loop_step calls it:
+    with e = reference_input - cpu as its argument, its three-band error, the anti-windup
+    reset and the rounding and clamping of u to max_pod. Each combination updates max_pod
+    every sample_rate seconds. Returns {metric name: array} with settling_time, overshoot,
+    itae and pod_churn per combination.
+    """
+    kp, ki, kd = grid["kp"], grid["ki"], grid["kd"]
+    reference_input, sample_rate = grid["reference_input"], grid["sample_rate"]
+    size = kp.size
+    sample_steps = np.maximum(1, np.round(sample_rate / dt)).astype(int)
+    delay_steps = max(1, int(round(pod_start_delay / dt)))
+
+    integral = np.zeros(size)
+    prev_e = np.zeros(size)
+    max_pod = np.ones(size)
+    pods = np.ones(size)
+    pods_history = np.ones((delay_steps, size))  # pods started delay_steps ago use CPU now
+    cpu = np.full(size, baseline_cpu)
+
+    itae = np.zeros(size)
+    overshoot = np.zeros(size)
+    churn = np.zeros(size)
+    last_outside = np.zeros(size)
+
+    for k in range(disturbance.size):
+        t = k * dt
+        # plant: the pods started pod_start_delay ago drive the CPU, seen through the metrics window
+        active_pods = pods_history[k % delay_steps].copy()
+        target = np.clip(baseline_cpu + disturbance[k] + cpu_per_pod * active_pods, 0.0, 1.0)
+        cpu += (target - cpu) * min(1.0, dt / metrics_window)
+
+        # controller, only the combinations whose sample period is due
+        due = k % sample_steps == 0
+        if due.any():
+            e_in = reference_input - cpu
+            err = np.where(
+                e_in < 0.75, 0.80 - e_in, np.where(e_in > 0.85, 0.85 - e_in, reference_input - e_in)
+            )
+            integral = np.where(due & (np.abs(integral) > 2.0), 0.0, integral)
+            integral = np.where(due, integral + sample_rate * err, integral)
+            derivative = (err - prev_e) / sample_rate
+            u = kp * err + ki * integral + kd * derivative
+            u = np.clip(np.round(u), 1, max_pod_upperbound)
+            prev_e = np.where(due, err, prev_e)
+            max_pod = np.where(due, u, max_pod)
+
+        # pods: filled up to max_pod at once, pods above it finish at the job completion rate
+        new_pods = np.where(
+            pods < max_pod, max_pod, pods - (pods - max_pod) * min(1.0, dt / job_duration)
+        )
+        churn += np.abs(new_pods - pods)
+        pods = new_pods
+        pods_history[k % delay_steps] = pods
+
+        error = np.abs(reference_input - cpu)
+        itae += t * error * dt
+        overshoot = np.maximum(overshoot, cpu - reference_input)
+        last_outside = np.where(error > settle_band, t + dt, last_outside)
+
+    return {
+        "settling_time": last_outside,
+        "overshoot": overshoot,
+        "itae": itae,
+        "pod_churn": churn,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Evaluate many PID gain sets at once against a CPU trace.")
+    parser.add_argument("--trace", help="recorded trace file, replayed as background CPU load")
+    parser.add_argument("--column", type=int, default=-1, help="column of the trace file to read")
+    parser.add_argument("--trace-step", type=float, default=1.0, help="seconds between trace rows")
+    parser.add_argument("--pods", action="store_true", help="the trace holds pod counts, not CPU")
+    parser.add_argument("--synthetic", default="step", help="none, step or sine, used without --trace")
+    parser.add_argument("--duration", type=float, default=1800, help="seconds of synthetic trace")
+    parser.add_argument("--kp", default="-3:1:9")
+    parser.add_argument("--ki", default="0:3:7")
+    parser.add_argument("--kd", default="0:2:5")
+    parser.add_argument("--reference-input", default="0.8")
+    parser.add_argument("--sample-rate", default="5")
+    parser.add_argument("--top", type=int, default=10, help="print the X combinations with the lowest ITAE")
+    parser.add_argument("--out", help="write every combination and its metrics to this CSV file")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
+    if args.trace:
+        disturbance = load_trace(args.trace, args.column, args.trace_step, args.pods)
+    else:
+        disturbance = synthetic_trace(args.synthetic, args.duration)
+    grid = make_grid(
+        parse_values(args.kp),
+        parse_values(args.ki),
+        parse_values(args.kd),
+        parse_values(args.reference_input),
+        parse_values(args.sample_rate),
+    )
+    logging.info(f"evaluating {grid['kp'].size} combinations over {disturbance.size * dt:.0f}s")
+    start = time.time()
+    metrics = evaluate(grid, disturbance)
+    logging.info(f"done in {time.time() - start:.2f}s")
+
+    columns = list(grid) + list(metrics)
+    rows = np.column_stack([grid[name] for name in grid] + [metrics[name] for name in metrics])
+    rows = rows[np.argsort(metrics["itae"])]
+    if args.out:
+        with open(args.out, "w", newline="") as file:
+            writer = csv.writer(file)
+            writer.writerow(columns)
+            writer.writerows(rows.tolist())
+    print(", ".join(columns))
+    for row in rows[: args.top]:
+        print(", ".join(f"{value:.4g}" for value in row))
@@ -0,0 +1,49 @@
+import functools
+import re
+
+quantity_cache_size = 4096  # number of distinct quantity strings whose parsed value is kept
+
+# suffix -> multiplier of a Kubernetes quantity, e.g. "250m" CPU or "16318460Ki" memory
+quantity_suffixes = {
+    "n": 1e-9,
+    "u": 1e-6,
+    "m": 1e-3,
+    "": 1,
+    "k": 1e3,
+    "M": 1e6,
+    "G": 1e9,
+    "T": 1e12,
+    "P": 1e15,
+    "E": 1e18,
+    "Ki": 2**10,
+    "Mi": 2**20,
+    "Gi": 2**30,
+    "Ti": 2**40,
+    "Pi": 2**50,
+    "Ei": 2**60,
+}
+# a number with an optional exponent ("1e3"), then a suffix; "1E" is 1 exa, not an exponent
+quantity_pattern = re.compile(r"([+-]?(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)([a-zA-Z]*)")
+
+
+@functools.lru_cache(maxsize=quantity_cache_size)
+def parse_quantity(value):
+    """convert a Kubernetes quantity string to a float in its base unit, cores or bytes
+
+    Node capacities and most usage values repeat from one sample to the next, so parsed
+    values are memoized. Raises ValueError on a malformed quantity.
+    """
+    match = quantity_pattern.fullmatch(value.strip())
+    if match is None or match.group(2) not in quantity_suffixes:
+        raise ValueError(f"invalid quantity: {value!r}")
+    return float(match.group(1)) * quantity_suffixes[match.group(2)]
+
+
+def parse_cpu(value):
+    """convert a CPU quantity ("4", "3500m", "123456789n") to nanocores"""
+    return parse_quantity(value) * 1e9
+
+
+def parse_memory(value):
+    """convert a memory quantity ("16318460Ki", "2Gi", "512M") to bytes"""
+    return parse_quantity(value)
@@ -0,0 +1,82 @@
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+
+
+class TimeSeriesRecorder:
+    """Append-only CSV recorder for controller samples.
+
+    Rows are buffered in memory and appended to the file in batches of batch_size (or on
+    flush()), so each sample costs constant I/O however long the run is. The file is
+    rotated to "<name>.<YYYYmmdd-HHMMSS><ext>" once it grows past max_bytes or, if max_age
+    is set, once it is older than max_age seconds.
+    """
+
+    def __init__(self, file_name, fields, batch_size=12, max_bytes=10 * 1024 * 1024, max_age=None):
+        self.file_name = file_name
+        self.fields = ["time"] + list(fields)
+        self.batch_size = batch_size
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.rows = []
+        self.opened_at = time.time()
+        self.lock = threading.Lock()
+
+    def record(self, *values):
+        """Buffer one row, timestamped now, with one value per field (None is written empty)."""
+        if len(values) != len(self.fields) - 1:
+            raise ValueError(f"expected {len(self.fields) - 1} values, got {len(values)}")
+        with self.lock:
+            self.rows.append((time.time(),) + values)
+            if len(self.rows) >= self.batch_size:
+                self.write_rows()
+
+    def flush(self):
+        """Append every buffered row to the file."""
+        with self.lock:
+            self.write_rows()
+
+    def write_rows(self):
+        if not self.rows:
+            return
+        lines = [
+            ",".join([f"{row[0]:.3f}"] + [format_value(value) for value in row[1:]]) + "\n"
+            for row in self.rows
+        ]
+        try:
+            self.rotate_if_needed()
+            new_file = not os.path.exists(self.file_name) or os.path.getsize(self.file_name) == 0
+            with open(self.file_name, "a") as file:
+                if new_file:
+                    file.write(",".join(self.fields) + "\n")
+                file.writelines(lines)
+            self.rows = []
+        except Exception as e:
+            # keep the rows, they are written with the next batch
+            logging.error(f"error occurred when saving data to {self.file_name}, error: {e}")
+
+    def rotate_if_needed(self):
+        if not os.path.exists(self.file_name):
+            return
+        too_big = os.path.getsize(self.file_name) >= self.max_bytes
+        too_old = self.max_age is not None and time.time() - self.opened_at >= self.max_age
+        if too_big or too_old:
+            root, ext = os.path.splitext(self.file_name)
+            rotated_name = f"{root}.{datetime.now().strftime('%Y%m%d-%H%M%S')}{ext}"
+            index = 1
+            while os.path.exists(rotated_name):
+                rotated_name = f"{root}.{datetime.now().strftime('%Y%m%d-%H%M%S')}-{index}{ext}"
+                index += 1
+            os.replace(self.file_name, rotated_name)
+            self.opened_at = time.time()
+            logging.info(f"rotated {self.file_name} to {rotated_name}")
+
+
+def format_value(value):
+    if value is None:
+        return ""
+    if isinstance(value, float):
+        return f"{value:.6g}"
+    return str(value)
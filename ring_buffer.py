@@ -0,0 +1,65 @@
+from array import array
+
+
+class RingBuffer:
+    """Fixed-capacity buffer of floats that keeps only the last `capacity` appended values.
+
+    Backed by an array('d'), appends are O(1) and memory stays constant. Indexing follows
+    list semantics (0 is the oldest kept value, -1 the newest); mean/min/max take an
+    optional window of the n newest values.
+    """
+
+    def __init__(self, capacity):
+        if capacity < 1:
+            raise ValueError("capacity must be at least 1")
+        self.capacity = capacity
+        self.data = array("d", [0.0]) * capacity
+        self.start = 0  # position of the oldest value in data
+        self.size = 0
+
+    def append(self, value):
+        end = (self.start + self.size) % self.capacity
+        self.data[end] = value
+        if self.size < self.capacity:
+            self.size += 1
+        else:
+            self.start = (self.start + 1) % self.capacity
+
+    def clear(self):
+        self.start = 0
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self.size
+        if not 0 <= index < self.size:
+            raise IndexError("ring buffer index out of range")
+        return self.data[(self.start + index) % self.capacity]
+
+    def __iter__(self):
+        for i in range(self.size):
+            yield self.data[(self.start + i) % self.capacity]
+
+    def last(self, n):
+        """Return the n newest values (fewer if the buffer holds fewer), oldest first."""
+        n = min(n, self.size)
+        return [self[i] for i in range(self.size - n, self.size)]
+
+    def window(self, n=None):
+        values = list(self) if n is None else self.last(n)
+        if not values:
+            raise ValueError("ring buffer is empty")
+        return values
+
+    def mean(self, n=None):
+        values = self.window(n)
+        return sum(values) / len(values)
+
+    def min(self, n=None):
+        return min(self.window(n))
+
+    def max(self, n=None):
+        return max(self.window(n))
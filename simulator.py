@@ -0,0 +1,332 @@
+import argparse
+import csv
+import heapq
+import logging
+import random
+import time
+from datetime import datetime, timedelta
+
+import global_controller
+from dispatch_queue import JobQueue, plan_dispatch
+import local_controller
+from jobs import parse_job
+from ring_buffer import RingBuffer
+
+# settings
+nodes = ["node0", "node1", "node2"]  # first one is the master node
+node_cores = 8  # CPU cores of each simulated node
+baseline_cores = 0.2  # cores used by the system daemons of a running node
+pod_start_delay = 8  # seconds between a pod creation and its stressors using CPU
+metrics_resolution = 15  # metrics-server refresh period, its CPU value is the mean over that window
+cpu_noise = 0.01  # standard deviation of the noise added to every CPU value
+reap_delay = 1  # seconds between a pod completion and the middleware reaper deleting it
+sim_start = datetime(2024, 1, 1)
+
+
+class SimNode:
+    def __init__(self, name, local):
+        self.name = name
+        self.local = local
+        self.running = False
+        self.started_at = None
+        self.pods = {}  # pod id -> (time its stressors start, completion time, cores)
+        self.finished_unreported = False  # a pod was reaped since the last get_pod_num
+        self.cpu = 0.0  # current metrics-server CPU value, fraction of the node
+        self.metrics_time = None  # simulated time of the metrics-server refresh that set cpu
+        self.cpu_samples = []
+        self.max_pod_samples = []
+        self.pid_updates = 0
+        self.skipped = 0
+
+    def load(self, start, end):
+        """Mean number of cores used over [start, end]."""
+        busy = baseline_cores * (end - start)
+        for cpu_start, cpu_end, cores in self.pods.values():
+            overlap = min(end, cpu_end) - max(start, cpu_start)
+            if overlap > 0:
+                busy += overlap * cores
+        return busy / (end - start)
+
+
+class Simulation:
+    """Discrete-event replay of a job list against the unchanged controller logic.
+
+    Every node has its own local_controller.NodeController, driven through
+    closed_loop_step; the global controller module is driven through controller_step, with
+    its middleware and local controller calls answered by the simulation. Time is simulated,
+    so a long trace replays in seconds.
+    """
+
+    def __init__(self, jobs, local_settings=None, global_settings=None, seed=0, trace_file=None):
+        self.jobs = jobs
+        self.local_settings = local_settings or {}
+        self.global_settings = global_settings or {}
+        self.random = random.Random(seed)
+        self.trace_file = trace_file
+        self.events = []
+        self.seq = 0
+        self.now = 0.0
+        self.nodes = {}
+        self.job_queue = JobQueue()
+        self.next_pod_id = 0
+        self.jobs_completed = 0
+        self.jobs_evicted = 0
+        self.jobs_skipped = 0
+        for description in jobs:
+            job, err = parse_job(description)
+            if err is not None:
+                self.jobs_skipped += 1
+            else:
+                self.job_queue.push(job)
+        self.scale_ups = 0
+        self.scale_downs = 0
+        self.cluster_cpu_samples = []
+        self.node_seconds = 0.0
+        self.log = []
+        self.trace = None
+
+    def schedule(self, delay, handler, *args):
+        self.seq += 1
+        heapq.heappush(self.events, (self.now + delay, self.seq, handler, args))
+
+    def now_datetime(self):
+        return sim_start + timedelta(seconds=self.now)
+
+    # middleware and local controller stand-ins used by global_controller
+    def start_new_node(self, node_name):
+        node = self.nodes[node_name]
+        node.running = True
+        node.started_at = self.now
+        self.scale_ups += 1
+        return True, ""
+
+    def start_controller(self, node_name):
+        self.nodes[node_name].local.running = True
+        return True, ""
+
+    def stop_controller(self, node_name):
+        self.nodes[node_name].local.stop()
+        return True, ""
+
+    def delete_node(self, node_name):
+        node = self.nodes[node_name]
+        self.jobs_evicted += len(node.pods)
+        node.pods = {}
+        node.running = False
+        node.cpu = 0.0
+        self.node_seconds += self.now - node.started_at
+        self.scale_downs += 1
+        return True, ""
+
+    def get_node_pod_num(self, node_name, timeout=None, retry=True):
+        return len(self.nodes[node_name].pods), None
+
+    def append_line_to_file(self, filename, line):
+        self.log.append(f"{self.now:.0f}s {line}")
+
+    # events
+    def refresh_metrics(self, node):
+        if node.running:
+            window_start = max(node.started_at, self.now - metrics_resolution)
+            if self.now > window_start:
+                cpu = node.load(window_start, self.now) / node_cores
+                cpu += self.random.gauss(0, cpu_noise)
+                node.cpu = min(1.0, max(0.0, cpu))
+                node.metrics_time = self.now
+        self.schedule(metrics_resolution, self.refresh_metrics, node)
+
+    def local_tick(self, node):
+        local = node.local
+        if node.running and local.running:
+            if node.finished_unreported:
+                local.last_pod_finish_time = self.now_datetime()
+                node.finished_unreported = False
+            pod_num = len(node.pods)
+            e, u = local.closed_loop_step(node.cpu, pod_num, self.now_datetime(), node.metrics_time)
+            if u is None:
+                node.skipped += 1
+            else:
+                node.pid_updates += 1
+            node.cpu_samples.append(node.cpu)
+            node.max_pod_samples.append(local.max_pod)
+            if self.trace is not None:
+                self.trace.writerow(
+                    [f"{self.now:.0f}", node.name, f"{node.cpu:.4f}", pod_num, local.max_pod, e, u]
+                )
+        self.schedule(local_controller.sample_rate, self.local_tick, node)
+
+    def global_sample(self):
+        cpus = [self.nodes[name].cpu for name in global_controller.started_nodes]
+        if cpus:
+            cluster_cpu = sum(cpus) / len(cpus)
+            global_controller.cluster_cpu.append(cluster_cpu)
+            self.cluster_cpu_samples.append(cluster_cpu)
+        self.schedule(global_controller.sample_time, self.global_sample)
+
+    def global_controller_tick(self):
+        global_controller.controller_step(self.now_datetime())
+        self.schedule(global_controller.loop_sleep_time, self.global_controller_tick)
+
+    def dispatch(self):
+        """Start as many queued jobs as the started nodes have room for, like dispatch_jobs."""
+        stats = {
+            name: (len(self.nodes[name].pods), self.nodes[name].local.max_pod)
+            for name in global_controller.started_nodes
+        }
+        placement = plan_dispatch(self.job_queue, stats, global_controller.placement_policy, self.now)
+        for entry, node_name in placement:
+            node = self.nodes[node_name]
+            cores, duration = entry.job.cores, entry.job.duration
+            pod_id = self.next_pod_id
+            self.next_pod_id += 1
+            cpu_start = self.now + pod_start_delay
+            node.pods[pod_id] = (cpu_start, cpu_start + duration, cores)
+            node.local.last_pod_start_time = self.now_datetime()
+            self.schedule(pod_start_delay + duration, self.pod_done, node, pod_id)
+        self.schedule(global_controller.job_assign_time, self.dispatch)
+
+    def pod_done(self, node, pod_id):
+        if pod_id in node.pods:
+            self.schedule(reap_delay, self.reap, node, pod_id)
+
+    def reap(self, node, pod_id):
+        if node.pods.pop(pod_id, None) is not None:
+            node.finished_unreported = True
+            self.jobs_completed += 1
+
+    def finished(self):
+        return len(self.job_queue) == 0 and not any(node.pods for node in self.nodes.values())
+
+    def run(self, max_time=30 * 86400):
+        """Replay the jobs until they all completed (or max_time simulated seconds), return a summary."""
+        overrides = {
+            "start_new_node": self.start_new_node,
+            "start_controller": self.start_controller,
+            "stop_controller": self.stop_controller,
+            "delete_node": self.delete_node,
+            "get_node_pod_num": self.get_node_pod_num,
+            "append_line_to_file": self.append_line_to_file,
+            "master_node": nodes[0],
+            "worker_nodes": list(nodes[1:]),
+            "started_nodes": [nodes[0]],
+            "cluster_cpu": RingBuffer(global_controller.cluster_cpu_history),
+            "last_started_time": sim_start,
+        }
+        overrides.update(self.global_settings)
+        saved = {key: getattr(global_controller, key) for key in overrides}
+        for key, value in overrides.items():
+            setattr(global_controller, key, value)
+        saved_local = {key: getattr(local_controller, key) for key in self.local_settings}
+        for key, value in self.local_settings.items():
+            setattr(local_controller, key, value)
+        trace_handle = open(self.trace_file, "w", newline="") if self.trace_file else None
+        self.trace = csv.writer(trace_handle) if trace_handle else None
+        if self.trace is not None:
+            self.trace.writerow(["time", "node", "cpu", "pod_num", "max_pod", "err", "u"])
+        wall_start = time.time()
+        try:
+            for name in nodes:
+                self.nodes[name] = SimNode(name, local_controller.NodeController(name))
+            master = self.nodes[nodes[0]]
+            self.start_new_node(master.name)
+            self.scale_ups -= 1  # the master node is not a scaling decision
+            self.start_controller(master.name)
+            for node in self.nodes.values():
+                self.schedule(0, self.refresh_metrics, node)
+                self.schedule(local_controller.sample_rate, self.local_tick, node)
+            self.schedule(global_controller.sample_time, self.global_sample)
+            self.schedule(global_controller.loop_sleep_time, self.global_controller_tick)
+            self.schedule(0, self.dispatch)
+            while self.events and not self.finished():
+                event_time, _, handler, args = heapq.heappop(self.events)
+                if event_time > max_time:
+                    break
+                self.now = event_time
+                handler(*args)
+        finally:
+            for key, value in saved.items():
+                setattr(global_controller, key, value)
+            for key, value in saved_local.items():
+                setattr(local_controller, key, value)
+            if trace_handle:
+                trace_handle.close()
+        for node in self.nodes.values():
+            if node.running:
+                self.node_seconds += self.now - node.started_at
+        return self.summary(time.time() - wall_start)
+
+    def summary(self, wall_seconds):
+        def mean(values):
+            return sum(values) / len(values) if values else 0.0
+
+        return {
+            "simulated_seconds": self.now,
+            "wall_seconds": wall_seconds,
+            "jobs": len(self.jobs) - self.jobs_skipped,
+            "jobs_completed": self.jobs_completed,
+            "jobs_evicted": self.jobs_evicted,
+            "scale_ups": self.scale_ups,
+            "scale_downs": self.scale_downs,
+            "node_seconds": self.node_seconds,
+            "mean_cluster_cpu": mean(self.cluster_cpu_samples),
+            "nodes": {
+                node.name: {
+                    "mean_cpu": mean(node.cpu_samples),
+                    "mean_max_pod": mean(node.max_pod_samples),
+                    "pid_updates": node.pid_updates,
+                    "skipped_iterations": node.skipped,
+                }
+                for node in self.nodes.values()
+            },
+        }
+
+
+def parse_settings(pairs):
+    """Parse ["name=value", ...] into {name: value}, values are numbers where they parse as one."""
+    settings = {}
+    for pair in pairs or []:
+        key, value = pair.split("=", 1)
+        for convert in (int, float, str):
+            try:
+                settings[key] = convert(value)
+                break
+            except ValueError:
+                continue
+    return settings
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay a job list against the controllers in simulated time.")
+    parser.add_argument("job_file", nargs="?", default=global_controller.job_file_name)
+    parser.add_argument("--jobs", type=int, help="cycle the job list until it has this many jobs")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--local", action="append", metavar="NAME=VALUE", help="local controller setting, e.g. job_delay=10")
+    parser.add_argument("--global", dest="global_", action="append", metavar="NAME=VALUE", help="global controller setting, e.g. cpu_bar=0.7 or placement_policy=spread")
+    parser.add_argument("--trace", help="write every local controller sample to this CSV file")
+    parser.add_argument("--log-level", default="CRITICAL", help="controller log level, e.g. INFO")
+    args = parser.parse_args()
+
+    # force, importing the controllers already configured logging
+    logging.basicConfig(level=args.log_level.upper(), format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", force=True)
+
+    job_list, error = global_controller.read_file_to_list(args.job_file)
+    if error is not None:
+        logging.critical(f"error getting the job list: {error}")
+        exit(1)
+    job_list = [job for job in job_list if job and not job.startswith("#")]
+    if args.jobs:
+        job_list = [job_list[i % len(job_list)] for i in range(args.jobs)]
+
+    simulation = Simulation(
+        job_list,
+        local_settings=parse_settings(args.local),
+        global_settings=parse_settings(args.global_),
+        seed=args.seed,
+        trace_file=args.trace,
+    )
+    result = simulation.run()
+    for key, value in result.items():
+        if key != "nodes":
+            print(f"{key}: {value}")
+    for node_name, stats in result["nodes"].items():
+        print(f"{node_name}: {stats}")